@@ -26,9 +26,17 @@ import apsw
 import os
 import os.path
 import re
+import time
+import threading
 import traceback
 
 
+# enough room in each connection's statement cache for every statement we use
+STATEMENT_CACHE_SIZE = 200
+
+IDENTIFIER_REGEX = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
 class ObData (object):
     datadir = os.path.expanduser('~/.openbroadcaster')
 
@@ -77,9 +85,12 @@ class ObData (object):
 
     def __init__(self):
         self.db = None
+        self.local = threading.local()
 
+    # statements are cached per connection by their sql text, so use bindings rather than building sql with values
+    # in it, and keep the cache big enough for all the statements we use.
     def open_db(self, filename):
-        return apsw.Connection(filename)
+        return apsw.Connection(filename, statementcachesize=STATEMENT_CACHE_SIZE)
 
     def table_exists(self, table):
         for row in self.execute("SELECT name FROM sqlite_master WHERE type IN ('table','view') AND name = ? UNION ALL SELECT name FROM sqlite_temp_master WHERE type IN ('table','view') AND name = ?", (table, table)):
@@ -89,12 +100,45 @@ class ObData (object):
     def empty_table(self, table):
         self.execute("DELETE from " + table)
 
+    # run a group of statements as a single transaction, rolled back if an exception is raised:
+    #   with data.transaction():
+    def transaction(self):
+        return self.db
+
+    # total number of rows changed since the database was opened. useful for telling if anything was written.
+    def total_changes(self):
+        return self.db.totalchanges()
+
+    # run query, returning a cursor over the rows. each call gets its own cursor, so other statements can be run
+    # while going through the results.
     def execute(self, query, bindings=None):
         return self.db.cursor().execute(query, bindings)
 
+    # the cursor used for statements that don't return rows. it's reused, one per thread.
+    def write_cursor(self):
+        cursor = getattr(self.local, 'cursor', None)
+        if cursor is None or cursor.getconnection() is not self.db:
+            cursor = self.db.cursor()
+            self.local.cursor = cursor
+        return cursor
+
+    # run an insert, update or delete statement. returns the number of rows changed.
+    def write(self, query, bindings=None):
+        self.write_cursor().execute(query, bindings)
+        return self.db.changes()
+
+    # run a statement once for each set of bindings in sequence.
+    def executemany(self, query, sequence):
+        self.write_cursor().executemany(query, sequence)
+
     # run query, return dict.
     def query(self, query, bindings=None):
-        cursor = self.db.cursor().execute(query, bindings)
+        return self.query_db(self.db, query, bindings)
+
+    # run query on the given connection, return dict.
+    @staticmethod
+    def query_db(db, query, bindings=None):
+        cursor = db.cursor().execute(query, bindings)
 
         try:
             cols = cursor.getdescription()
@@ -111,16 +155,14 @@ class ObData (object):
         return text.replace("'", "''")
 
     def row_addedit(self, table, data):
-        column_list = []
-        value_list = []
-
-        for (key, value) in data.items():
-            column_list.append("'" + self.escape(str(key)) + "'")
-            value_list.append("'" + self.escape(str(value)) + "'")
+        columns = list(data.keys())
+        for column in columns:
+            if not IDENTIFIER_REGEX.match(column):
+                raise ValueError("invalid column name: " + str(column))
 
         # this is INSERT or REPLACE, so if we have (for example) ID set in data, then it will edit. Otherwise it will insert.
         # Other unique keys may cause replace (edit) so be careful.
-        self.execute("INSERT or REPLACE into " + table + " ( " + ','.join(column_list) + " ) VALUES ( " + ','.join(value_list) + " )")
+        self.write("INSERT or REPLACE into " + table + " ( " + ','.join(columns) + " ) VALUES ( " + ','.join('?' * len(columns)) + " )", tuple(str(data[column]) for column in columns))
         return self.db.last_insert_rowid()
 
 
@@ -129,6 +171,7 @@ class ObConfigData (ObData):
 
     def __init__(self):
         ObData.__init__(self)
+        start_time = time.time()
 
         self.headless = False
         self.args = None
@@ -140,7 +183,7 @@ class ObConfigData (ObData):
             self.execute("CREATE TABLE settings (id INTEGER PRIMARY KEY, name TEXT, value TEXT, type TEXT)")
             self.execute("CREATE UNIQUE INDEX name_index on settings(name)")
 
-        self.check_defaults()
+        defaults_added = self.check_defaults()
 
         self.settings_cache = {}
         self.settings_type = {}
@@ -167,6 +210,8 @@ class ObConfigData (ObData):
         if not self.setting("video_out_enable"):
             self.headless = True
 
+        obplayer.Log.log('loaded ' + str(len(self.settings_cache)) + ' settings (' + str(defaults_added) + ' defaults added) in ' + str(int((time.time() - start_time) * 1000)) + 'ms', 'data')
+
     def validate_settings(self, settings):
         for (setting_name, setting_value) in settings.items():
             error = self.validate_setting(setting_name, setting_value, settings)
@@ -215,6 +260,31 @@ class ObConfigData (ObData):
         if setting_name == 'sync_freq_playlog' and self.is_int(setting_value) == False:
             return 'sync_freq_playlog_invalid'
 
+        if setting_name == 'sync_playlog_page_size' and (self.is_int(setting_value) == False or int(setting_value) < 1):
+            return 'sync_playlog_page_size_invalid'
+
+        if setting_name == 'sync_media_workers' and (self.is_int(setting_value) == False or int(setting_value) < 1):
+            return 'sync_media_workers_invalid'
+
+        if setting_name == 'sync_bandwidth_limit' and self.is_int(setting_value) == False:
+            return 'sync_bandwidth_limit_invalid'
+
+        window_regex = re.compile(r'^\s*(\d{1,2}:\d{2}\s*-\s*\d{1,2}:\d{2}\s*=\s*\d+\s*(,\s*|$))*$')
+        if setting_name == 'sync_bandwidth_windows' and window_regex.match(setting_value) == None:
+            return 'sync_bandwidth_windows_invalid'
+
+        if setting_name == 'sync_bandwidth_urgent' and self.is_int(setting_value) == False:
+            return 'sync_bandwidth_urgent_invalid'
+
+        if setting_name == 'sync_media_scrub_rate' and (self.is_int(setting_value) == False or int(setting_value) < 0):
+            return 'sync_media_scrub_rate_invalid'
+
+        if setting_name == 'sync_media_cache_size' and (self.is_int(setting_value) == False or int(setting_value) < 0):
+            return 'sync_media_cache_size_invalid'
+
+        if setting_name == 'sync_media_gc_rate' and (self.is_int(setting_value) == False or int(setting_value) < 0):
+            return 'sync_media_gc_rate_invalid'
+
         if setting_name == 'streamer_icecast_bitrate' and (self.is_int(setting_value) == False or int(setting_value) not in [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320]):
             return 'streamer_icecast_bitrate_invalid'
 
@@ -298,8 +368,24 @@ class ObConfigData (ObData):
         self.save_settings(settings)
     """
 
-    # make sure we have all our required settings. if not, add setting with default value.
+    # make sure we have all our required settings. if not, add setting with default value. the existing names are
+    # read once, and any missing settings are added in a single transaction. returns the number of settings added.
     def check_defaults(self):
+        self.existing_settings = set(row[0] for row in self.execute("SELECT name FROM settings"))
+        self.new_settings = [ ]
+
+        self.add_default_settings()
+
+        if self.new_settings:
+            with self.transaction():
+                self.executemany("INSERT or REPLACE into settings (name, value, type) VALUES (?, ?, ?)", self.new_settings)
+
+        count = len(self.new_settings)
+        self.existing_settings = None
+        self.new_settings = None
+        return count
+
+    def add_default_settings(self):
         self.add_setting('audio_out_mode', 'auto', 'text')
         self.add_setting('audio_out_alsa_device', 'default', 'text')
         self.add_setting('audio_out_jack_name', '', 'text')
@@ -377,8 +463,22 @@ class ObConfigData (ObData):
         self.add_setting('sync_freq', '2', 'int')
         self.add_setting('sync_freq_priority', '1', 'int')
         self.add_setting('sync_freq_playlog', '3', 'int')
+        self.add_setting('sync_playlog_page_size', '500', 'int')
+        self.add_setting('sync_playlog_compress', '0', 'bool')
+        self.add_setting('sync_notify_enable', '0', 'bool')
         self.add_setting('sync_mode', 'remote', 'text')
         self.add_setting('sync_copy_media_to_backup', '0', 'bool')
+        self.add_setting('sync_media_workers', '2', 'int')
+        self.add_setting('sync_media_verify_hash', '0', 'bool')
+        self.add_setting('sync_media_dedup', '0', 'bool')
+        self.add_setting('sync_media_scrub_enable', '0', 'bool')
+        self.add_setting('sync_media_scrub_rate', '10', 'int')
+        self.add_setting('sync_bandwidth_limit', '0', 'int')
+        self.add_setting('sync_bandwidth_windows', '', 'text')
+        self.add_setting('sync_bandwidth_urgent', '60', 'int')
+        self.add_setting('sync_media_gc_rate', '5', 'int')
+        self.add_setting('sync_media_cache_size', '0', 'int')
+        self.add_setting('sync_media_progressive', '1', 'bool')
         self.add_setting('remote_media', self.datadir + '/media', 'text')
         self.add_setting('local_media', '', 'text')
 
@@ -484,20 +584,12 @@ class ObConfigData (ObData):
         self.add_setting('led_sign_timedisplay', '0', 'bool')
         self.add_setting('led_sign_init_message', '', 'text')
 
+    # queue a setting to be added by check_defaults(), if it doesn't already exist.
     def add_setting(self, name, value, datatype=None):
-
-        check_setting = self.query("SELECT name,value,type from 'settings' WHERE name = '" + self.escape(name) + "'")
-        if len(check_setting):
+        if name in self.existing_settings:
             return
-
-        data = {}
-        data['name'] = name
-        data['value'] = value
-
-        if datatype != None:
-            data['type'] = datatype
-
-        self.row_addedit('settings', data)
+        self.existing_settings.add(name)
+        self.new_settings.append((name, value, datatype))
 
     def setting(self, name, use_edit_cache=False):
         settings = self.settings_edit_cache if use_edit_cache else self.settings_cache
@@ -508,6 +600,7 @@ class ObConfigData (ObData):
 
     # save our settings into the database. update settings_edit_cache to handle subsequent edits.
     def save_settings(self, settings):
+        updates = [ ]
         for (name, value) in settings.items():
             dataType = self.settings_type[name]
             if dataType == 'int':
@@ -519,7 +612,10 @@ class ObConfigData (ObData):
             else:
                 self.settings_edit_cache[name] = str(value)
 
-            self.query('UPDATE settings set value="' + self.escape(str(value)) + '" where name="' + self.escape(name) + '"')
+            updates.append((str(value), name))
+
+        with self.transaction():
+            self.executemany("UPDATE settings set value=? where name=?", updates)
 
     def list_settings(self, hidepasswords=False):
         result = { }
@@ -239,6 +239,22 @@ Site.updateStatusInfo = function()
 	$('#show-summary-last-updated').html(Site.friendlyTime(response.show.last_updated));
       }
 
+      if(response.sync){
+	$('#sync-summary-downloads').html(response.sync.downloads);
+	$('#sync-summary-rate').html(Math.round(response.sync.rate / 1024) + ' KB/s');
+	$('#sync-summary-limit').html(response.sync.limit ? Math.round(response.sync.limit / 1024) + ' KB/s' : Site.t('Status Tab', 'Unlimited'));
+	$('#sync-summary-total').html(Math.round(response.sync.total_bytes / 1048576) + ' MB');
+      }
+
+      if(response.schedule){
+	var next_show = response.schedule.upcoming[0];
+	var next_gap = response.schedule.gaps[0];
+	$('#schedule-summary-next-name').html(next_show ? next_show.name : '');
+	$('#schedule-summary-next-start').html(next_show ? Site.friendlyTime(next_show.start_time) : '');
+	$('#schedule-summary-next-gap').html(next_gap ? Site.friendlyTime(next_gap.start) : '');
+	$('#schedule-summary-unscheduled').html(Site.friendlyDuration(response.schedule.unscheduled));
+      }
+
       if(response.audio){
 	$('#audio-summary-media-type').html(Site.t('Status Media Type', response.audio.media_type));
 	$('#audio-summary-order-num').html(response.audio.order_num);
@@ -66,7 +66,7 @@ class ObHTTPAdmin (httpserver.ObHTTPServer):
 
 
     def log(self, message):
-        if not "POST /status_info" in message and not "POST /alerts/list" in message:
+        if not "POST /status_info" in message and not "POST /alerts/list" in message and not "POST /sync/status" in message:
             obplayer.Log.log(message, 'debug')
 
     def form_item_selected(self, setting, value):
@@ -92,6 +92,8 @@ class ObHTTPAdmin (httpserver.ObHTTPServer):
     def register_routes(self):
         self.route('/status_info', self.req_status_info)
         self.route('/alerts/list', self.req_alert_list)
+        self.route('/sync/status', self.req_sync_status)
+        self.route('/schedule/shows', self.req_schedule_shows)
         self.route('/strings', self.req_strings)
         self.route('/command/restart', self.req_restart)
         self.route('/command/fstoggle', self.req_fstoggle)
@@ -127,9 +129,36 @@ class ObHTTPAdmin (httpserver.ObHTTPServer):
         data['audio_levels'] = obplayer.Player.get_audio_levels()
         if hasattr(obplayer, 'scheduler'):
             data['show'] = obplayer.Scheduler.get_show_info()
+            data['sync'] = obplayer.Sync.bandwidth.get_status()
+            with obplayer.Sync.downloads_lock:
+                data['sync']['downloads'] = len(obplayer.Sync.downloads)
+            data['schedule'] = obplayer.RemoteData.get_schedule_overview(data['time'], 1)
         data['logs'] = obplayer.Log.get_log()
         return data
 
+    def req_sync_status(self, request):
+        if hasattr(obplayer, 'scheduler'):
+            return obplayer.Sync.get_status()
+        return { 'status' : False }
+
+    def req_schedule_shows(self, request):
+        if not hasattr(obplayer, 'scheduler'):
+            return { 'status' : False }
+        count = self.number_arg(request, 'count', 10, 1, 100, int)
+        hours = self.number_arg(request, 'hours', 24, 0, 168, float)
+        return obplayer.RemoteData.get_schedule_overview(time.time(), count, hours * 3600)
+
+    # read a number from the request, using the default if it's missing or isn't a number, and keeping it in range
+    @staticmethod
+    def number_arg(request, name, default, minimum, maximum, convert):
+        try:
+            value = convert(request.args[name][0])
+        except (KeyError, IndexError, ValueError, OverflowError):
+            return default
+        if value != value:
+            return default
+        return min(max(value, minimum), maximum)
+
     def req_geocodes_list(self, request):
         data = obplayer.Config.setting('alerts_geocode', True)
         res = httpserver.Response()
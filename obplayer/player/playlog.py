@@ -57,20 +57,23 @@ class ObPlaylogData (obplayer.ObData):
         else:
             context = 'fallback'
 
-        self.execute("INSERT INTO playlog VALUES (null, ?, ?, ?, ?, ?, ?, ?)", (media_id, artist, title, datetime, context, str(0), notes))
+        self.write("INSERT INTO playlog VALUES (null, ?, ?, ?, ?, ?, ?, ?)", (media_id, artist, title, datetime, context, str(0), notes))
         return self.db.last_insert_rowid()
 
     #
     # Get playlog from given timestamp (used for syncing with web app database)
+    # If limit is given, returns at most that many entries with an id greater than after_id, in id order.
     #
-    def get_entries_since(self, timestamp):
-        return self.query("SELECT id,media_id,artist,title,datetime,context,emerg_id,notes from playlog WHERE datetime > " + str(timestamp))
+    def get_entries_since(self, timestamp, after_id=0, limit=None):
+        if limit is None:
+            return self.query("SELECT id,media_id,artist,title,datetime,context,emerg_id,notes from playlog WHERE datetime > ?", (float(timestamp),))
+        return self.query("SELECT id,media_id,artist,title,datetime,context,emerg_id,notes from playlog WHERE datetime > ? AND id > ? ORDER BY id LIMIT ?", (float(timestamp), int(after_id), int(limit)))
 
     #
     # Remove playlog entries since ID (used after a successful sync with web app database)
     #
     def remove_entries_since(self, entryid):
-        self.execute("DELETE from playlog WHERE id <= " + str(entryid))
+        self.write("DELETE from playlog WHERE id <= ?", (int(entryid),))
         return True
 
 
@@ -25,7 +25,7 @@ from __future__ import absolute_import
 import obplayer
 
 from .scheduler import ObScheduler
-from .sync import ObSync, VersionUpdateThread, SyncShowsThread, SyncEmergThread, SyncMediaThread, SyncPlaylogThread, Sync_Alert_Media_Thread
+from .sync import ObSync, VersionUpdateThread, SyncShowsThread, SyncEmergThread, SyncMediaThread, SyncPlaylogThread, SyncNotifyThread, Sync_Alert_Media_Thread
 from .priority import ObPriorityBroadcaster
 from .data import ObRemoteData
 
@@ -66,9 +66,21 @@ def init():
     SyncEmergThread().start()
     SyncMediaThread().start()
     SyncPlaylogThread().start()
+    SyncNotifyThread().start()
+    obplayer.Sync.now_playing_thread.start()
+    obplayer.Sync.scrubber.start()
+    obplayer.Sync.media_watcher.start()
+    if obplayer.Sync.progressive_server:
+        obplayer.Sync.progressive_server.start()
+    obplayer.RemoteData.snapshot.start()
     Sync_Alert_Media_Thread().start()
 
 def quit():
     # backup our main db to disk.
     if hasattr(obplayer, 'RemoteData') and obplayer.Main.exit_code == 0:
-        obplayer.RemoteData.backup()
+        obplayer.RemoteData.backup(True)
+
+    if hasattr(obplayer, 'Sync'):
+        obplayer.Sync.curl_pool.close()
+        if obplayer.Sync.progressive_server:
+            obplayer.Sync.progressive_server.stop()
@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Copyright 2012-2015 OpenBroadcaster, Inc.
+
+This file is part of OpenBroadcaster Player.
+
+OpenBroadcaster Player is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+OpenBroadcaster Player is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with OpenBroadcaster Player.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import obplayer
+
+import re
+import time
+import threading
+
+
+# matches a single transfer window, ie. "06:00-22:00=128"
+WINDOW_REGEX = re.compile(r'^\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*=\s*(\d+)\s*$')
+
+# the longest a download is put to sleep at once before the bucket is checked again
+MAX_SLEEP = 0.5
+
+
+#
+# Shared rate limiter for media downloads.  All download workers pass the data they receive through throttle(),
+# which sleeps as needed to keep the total rate under the limit for the present time of day (a token bucket).
+# Media that is needed on air soon is counted, but never held back.
+#
+class ObBandwidthManager (object):
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        self.default_limit = obplayer.Config.setting('sync_bandwidth_limit') * 1024
+        self.windows = self.parse_windows(obplayer.Config.setting('sync_bandwidth_windows'))
+        self.urgent_time = obplayer.Config.setting('sync_bandwidth_urgent') * 60
+
+        self.tokens = 0
+        self.last_refill = time.time()
+
+        # throughput counters
+        self.total_bytes = 0
+        self.urgent_bytes = 0
+        self.throttled_time = 0
+        self.rate = 0
+        self.rate_bytes = 0
+        self.rate_start = time.time()
+
+    #
+    # Parse a list of transfer windows, ie. "00:00-06:00=0,06:00-22:00=128", into (start minute, end minute, bytes/s).
+    # A limit of 0 means unlimited.  Windows may wrap around midnight.
+    #
+    @staticmethod
+    def parse_windows(text):
+        windows = [ ]
+        for entry in text.split(','):
+            if not entry.strip():
+                continue
+            match = WINDOW_REGEX.match(entry)
+            if not match:
+                raise ValueError('invalid transfer window: ' + entry)
+            (start_hour, start_min, end_hour, end_min, limit) = [ int(value) for value in match.groups() ]
+            windows.append((start_hour * 60 + start_min, end_hour * 60 + end_min, limit * 1024))
+        return windows
+
+    # returns the rate limit in bytes/second at the given time (0 for unlimited)
+    def current_limit(self, present_time=None):
+        localtime = time.localtime(present_time)
+        minutes = localtime.tm_hour * 60 + localtime.tm_min
+        for (start, end, limit) in self.windows:
+            if (start <= minutes < end) if start <= end else (minutes >= start or minutes < end):
+                return limit
+        return self.default_limit
+
+    # media due on air within sync_bandwidth_urgent minutes is exempt from the limit
+    def is_urgent(self, deadline):
+        return deadline is not None and deadline - time.time() <= self.urgent_time
+
+    #
+    # Count data received, and wait until the bucket has room for it.  The bucket never goes more than a second's
+    # worth of data into debt, so that an urgent download (which is counted but not held back) can't leave the
+    # next download waiting for minutes in the middle of its transfer.
+    #
+    def throttle(self, nbytes, urgent=False):
+        with self.lock:
+            present_time = time.time()
+            self.count_bytes(nbytes, urgent, present_time)
+
+            limit = self.refill(present_time)
+            if limit <= 0:
+                return
+            self.tokens = max(-limit, self.tokens - nbytes)
+            if urgent:
+                return
+
+        # sleep in short steps, checking again each time, so that quitting or a change of limit isn't held up
+        while not obplayer.Sync.quit:
+            with self.lock:
+                limit = self.refill(time.time())
+                if limit <= 0 or self.tokens >= 0:
+                    return
+                wait = min(MAX_SLEEP, -self.tokens / float(limit))
+                self.throttled_time += wait
+            time.sleep(wait)
+
+    # top up the bucket for the time since it was last filled, and return the present limit (0 for unlimited)
+    def refill(self, present_time):
+        limit = self.current_limit(present_time)
+        if limit <= 0:
+            self.tokens = 0
+        else:
+            self.tokens = min(limit, self.tokens + (present_time - self.last_refill) * limit)
+        self.last_refill = present_time
+        return limit
+
+    def count_bytes(self, nbytes, urgent, present_time):
+        self.total_bytes += nbytes
+        if urgent:
+            self.urgent_bytes += nbytes
+
+        self.rate_bytes += nbytes
+        if present_time - self.rate_start >= 1:
+            self.rate = self.rate_bytes / (present_time - self.rate_start)
+            self.rate_bytes = 0
+            self.rate_start = present_time
+
+    def get_status(self):
+        with self.lock:
+            # if nothing has come in for a while, the rate has dropped to nothing
+            rate = self.rate if time.time() - self.rate_start < 5 else 0
+            return {
+                'limit' : self.current_limit(),
+                'rate' : rate,
+                'total_bytes' : self.total_bytes,
+                'urgent_bytes' : self.urgent_bytes,
+                'throttled_time' : self.throttled_time
+            }
@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Copyright 2012-2015 OpenBroadcaster, Inc.
+
+This file is part of OpenBroadcaster Player.
+
+OpenBroadcaster Player is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+OpenBroadcaster Player is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with OpenBroadcaster Player.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import obplayer
+
+import os
+import re
+import threading
+
+
+BLOB_DIR = '.blobs'
+
+# blobs are named by the md5 hash of their contents
+HASH_REGEX = re.compile(r'^[0-9a-f]{32}$')
+
+
+#
+# Content addressed store for media files, kept in remote_media/.blobs/<first two hash digits>/<hash>.  Each media
+# file is a hardlink to its blob, so the same audio under several media ids or filenames is only downloaded and
+# stored once.  The number of media files using a blob is its link count minus one; blobs no longer used by any
+# media file are removed by remove_unreferenced().
+#
+class ObBlobStore (object):
+    def __init__(self, root):
+        self.root = root + '/' + BLOB_DIR
+        self.lock = threading.Lock()
+
+        # media linked from the store instead of being downloaded or copied
+        self.linked_count = 0
+        self.linked_bytes = 0
+
+    def blob_path(self, file_hash):
+        if not file_hash:
+            return None
+        file_hash = file_hash.lower()
+        if not HASH_REGEX.match(file_hash):
+            return None
+        return self.root + '/' + file_hash[0:2] + '/' + file_hash
+
+    #
+    # Put the media file in place by linking it to a stored blob with the same hash.  Returns True on success.
+    #
+    def link_media(self, media, media_outfilename):
+        blob = self.blob_path(media['file_hash'])
+        if blob is None:
+            return False
+
+        try:
+            if os.path.getsize(blob) != media['file_size']:
+                return False
+            tmpfilename = media_outfilename + '.part'
+            if os.path.lexists(tmpfilename):
+                os.remove(tmpfilename)
+            os.link(blob, tmpfilename)
+            os.rename(tmpfilename, media_outfilename)
+        except OSError:
+            return False
+
+        with self.lock:
+            self.linked_count += 1
+            self.linked_bytes += media['file_size']
+        return True
+
+    #
+    # Add a media file to the store, if it isn't there already.  Unless the caller has already verified the file
+    # against file_hash, it is hashed first so that a bad copy never ends up shared with other media.
+    #
+    def add(self, filename, file_hash, verified=False):
+        blob = self.blob_path(file_hash)
+        if blob is None or os.path.exists(blob):
+            return False
+
+        if not verified and obplayer.Sync.file_hash(filename) != file_hash.lower():
+            obplayer.Log.log('not adding ' + filename + ' to media store, hash does not match', 'sync')
+            return False
+
+        try:
+            obplayer.Sync.make_media_dir(self.root)
+            obplayer.Sync.make_media_dir(os.path.dirname(blob))
+            os.link(filename, blob)
+        except OSError as e:
+            # already added by another worker, or the filesystem doesn't support hardlinks
+            if not os.path.exists(blob):
+                obplayer.Log.log('unable to add ' + filename + ' to media store: ' + str(e), 'error')
+            return False
+        return True
+
+    #
+    # Remove the blob for file_hash if it is the same file as filename, ie. when the media file turned out to be bad.
+    #
+    def discard(self, file_hash, filename):
+        blob = self.blob_path(file_hash)
+        try:
+            if blob is not None and os.path.samefile(blob, filename):
+                os.remove(blob)
+        except OSError:
+            pass
+
+    #
+    # Remove blobs which are no longer linked to any media file.  Returns the number of blobs removed.
+    #
+    def remove_unreferenced(self):
+        if not os.path.isdir(self.root):
+            return 0
+
+        removed = 0
+        for subdir in os.scandir(self.root):
+            if not subdir.is_dir(follow_symlinks=False):
+                continue
+            for entry in os.scandir(subdir.path):
+                try:
+                    if entry.stat(follow_symlinks=False).st_nlink <= 1:
+                        obplayer.Log.log('removing unused media blob ' + entry.name, 'sync')
+                        os.remove(entry.path)
+                        removed += 1
+                except OSError:
+                    obplayer.Log.log('unable to remove media blob ' + entry.path, 'error')
+        return removed
+
+    def get_status(self):
+        with self.lock:
+            data = { }
+            data['linked'] = self.linked_count
+            data['linked_bytes'] = self.linked_bytes
+            return data
@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Copyright 2012-2015 OpenBroadcaster, Inc.
+
+This file is part of OpenBroadcaster Player.
+
+OpenBroadcaster Player is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+OpenBroadcaster Player is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with OpenBroadcaster Player.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import pycurl
+
+import threading
+
+
+#
+# Pool of reusable curl handles for talking to the sync server.  Handles are reset rather than closed between
+# requests so that open connections are kept alive, and all handles use a share handle so that DNS lookups, TLS
+# sessions and (where libcurl supports it) the connection cache are shared between threads.
+#
+class ObCurlPool (object):
+    def __init__(self, max_idle=4):
+        self.max_idle = max_idle
+        self.idle = [ ]
+        self.lock = threading.Lock()
+
+        self.share = pycurl.CurlShare()
+        self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+        self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
+        if hasattr(pycurl, 'LOCK_DATA_CONNECT'):
+            self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_CONNECT)
+
+    def acquire(self):
+        with self.lock:
+            curl = self.idle.pop() if self.idle else None
+
+        if curl is None:
+            curl = pycurl.Curl()
+            curl.setopt(pycurl.SHARE, self.share)
+        else:
+            # reset clears all options, but keeps the handle's connections and caches.  it doesn't unshare the
+            # handle though, and setting the share again is an error, so that's only done for new handles.
+            curl.reset()
+
+        curl.setopt(pycurl.NOSIGNAL, 1)
+        curl.setopt(pycurl.USERAGENT, 'OpenBroadcaster Player')
+        return curl
+
+    def release(self, curl):
+        with self.lock:
+            if len(self.idle) < self.max_idle:
+                self.idle.append(curl)
+                return
+        curl.close()
+
+    def close(self):
+        with self.lock:
+            idle = self.idle
+            self.idle = [ ]
+        for curl in idle:
+            curl.close()
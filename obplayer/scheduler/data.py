@@ -22,7 +22,64 @@ along with OpenBroadcaster Player.  If not, see <http://www.gnu.org/licenses/>.
 
 import obplayer
 
+import apsw
 import time
+import threading
+import contextlib
+
+from .snapshot import ObSnapshotThread, check_snapshot
+from .showindex import ObShowIndex
+
+
+# the tables that are written during sync, and so are built in a shadow copy and swapped in (see shadow())
+SHADOW_TABLES = ('shows', 'shows_media', 'groups', 'group_items', 'priority_broadcasts', 'alert_media')
+
+
+# a shadow copy being built by shadow().  the copy itself (db) isn't made until the first write.
+class ObShadow (object):
+    def __init__(self, tables):
+        self.tables = tables
+        self.db = None
+        self.generation = None
+        self.changes = 0
+
+
+#
+# A read-only row which can be used like the dictionaries returned by query() (row['title'], 'title' in row), but
+# only takes up a slot per column.  Subclasses list their columns in __slots__.
+#
+class ObRow (object):
+    __slots__ = ()
+
+    def __init__(self, values):
+        for (name, value) in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("rows are read-only")
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def keys(self):
+        return self.__slots__
+
+
+class ObGroupItem (ObRow):
+    __slots__ = ('id', 'group_id', 'media_id', 'order_num', 'filename', 'artist', 'title', 'duration', 'media_type', 'file_hash', 'file_size', 'file_location', 'approved', 'archived')
+
+
+class ObGroup (ObRow):
+    __slots__ = ('id', 'local_show_id', 'name', 'items')
 
 
 class ObRemoteData (obplayer.ObData):
@@ -30,6 +87,10 @@ class ObRemoteData (obplayer.ObData):
     def __init__(self):
         obplayer.ObData.__init__(self)
 
+        # counts the shadow copies that have been swapped in
+        self.generation = 0
+        self.swap_lock = threading.Lock()
+
         # our main database, stored in memory.
         self.db = self.open_db(':memory:')
 
@@ -59,35 +120,153 @@ class ObRemoteData (obplayer.ObData):
             obplayer.Log.log('alert media table not found, creating', 'data')
             self.alert_media_create_table()
 
+        if not self.table_exists('required_media'):
+            obplayer.Log.log('required media table not found, creating', 'data')
+            self.required_media_create_table()
+        self.required_media_create_triggers()
+        self.required_media_check()
+
         self.priority_broadcasts = False
 
-    def backup(self):
-        obplayer.Log.log('backup database to disk', 'data')
-        backupcon = self.open_db(self.datadir + '/data.db')
+        # sorted index of the shows, rebuilt from the database the first time it's used after the schedule changes
+        self.shows_index = None
+
+        # live assist groups loaded by load_groups(), keyed by local show id, and the generation they're from
+        self.groups_cache = { }
+        self.groups_generation = None
+
+        # the media required by the schedule as of the last call to media_required(), and the generation it's from
+        self.required_cache = None
+        self.required_generation = None
+
+        # in-memory copy of the version info for each show, keyed by start time, so unchanged shows can be skipped during sync
+        self.show_versions = {}
+        self.load_show_versions()
+
+        # saves the database to disk in the background, started with the sync threads
+        self.snapshot = ObSnapshotThread(self, self.datadir + '/data.db')
+
+    def open_db(self, filename):
+        db = obplayer.ObData.open_db(self, filename)
+        # INSERT or REPLACE has to fire the delete triggers for the rows it replaces, or required_media would be wrong
+        db.cursor().execute("PRAGMA recursive_triggers = ON")
+        return db
+
+    def load_show_versions(self):
+        self.show_versions = {}
+        for row in self.execute("SELECT datetime,show_id,last_updated,duration,id from shows"):
+            self.show_versions[int(row[0])] = (int(row[1]), int(row[2]), float(row[3]), row[4])
+
+    # the live database, or for a thread that has started writing to a shadow copy, its copy
+    @property
+    def db(self):
+        shadow = getattr(self.local, 'shadow', None)
+        if shadow is not None and shadow.db is not None:
+            return shadow.db
+        return self.live_db
+
+    @db.setter
+    def db(self, db):
+        self.live_db = db
+
+    # all writes get their cursor here, so this is where a shadow copy is made, on its first write
+    def write_cursor(self):
+        shadow = getattr(self.local, 'shadow', None)
+        if shadow is not None and shadow.db is None:
+            self.shadow_copy(shadow)
+        return obplayer.ObData.write_cursor(self)
+
+    def shadow_copy(self, shadow):
+        with self.swap_lock:
+            shadow.generation = self.generation
+            db = self.open_db(':memory:')
+            with db.backup('main', self.live_db, 'main') as backup:
+                backup.step()
+        shadow.changes = db.totalchanges()
+        db.cursor().execute("BEGIN")
+        shadow.db = db
 
-        with backupcon.backup('main', self.db, 'main') as backup:
-            backup.step()
+    #
+    # Make changes to a copy of the database, and swap it in for the live one when done, so the player always reads
+    # a complete schedule and never waits on a sync in progress.  The copy is only made when the calling thread first
+    # writes something; until then it reads the live database, and from then on (and only that thread) the copy.
+    # If an exception is raised, or nothing was changed, the copy is thrown away.  Each sync only writes its own
+    # tables, so if another sync swapped in its copy in the meantime, the tables we didn't write are brought over
+    # from it before ours is swapped in:
+    #   with data.shadow([ 'priority_broadcasts' ]):
+    #
+    @contextlib.contextmanager
+    def shadow(self, tables):
+        shadow = ObShadow(tables)
+        self.local.shadow = shadow
+        try:
+            yield
+            if shadow.db is not None:
+                shadow.db.cursor().execute("COMMIT")
+        except:
+            if shadow.db is not None and not shadow.db.getautocommit():
+                shadow.db.cursor().execute("ROLLBACK")
+            self.local.shadow = None
+            # show_versions belongs to the schedule sync, so only it can put it back
+            if 'shows' in tables:
+                self.load_show_versions()
+            raise
+        finally:
+            self.local.shadow = None
+            self.local.cursor = None
+
+        if shadow.db is None or shadow.db.totalchanges() == shadow.changes:
+            return
+
+        with self.swap_lock:
+            if self.generation != shadow.generation:
+                others = [ table for table in SHADOW_TABLES if table not in tables ]
+                obplayer.Log.log('database changed during sync, copying ' + ', '.join(others), 'data')
+                with shadow.db:
+                    for table in others:
+                        self.copy_table(self.live_db, shadow.db, table)
+            self.live_db = shadow.db
+            self.generation += 1
 
-        backupcon.close()
-        obplayer.Log.log('done backing up', 'data')
+    @staticmethod
+    def copy_table(source, dest, table):
+        dest.cursor().execute("DELETE from " + table)
+        cursor = source.cursor().execute("SELECT * from " + table)
+        try:
+            cols = cursor.getdescription()
+        except apsw.ExecutionCompleteError:
+            return
+        dest.cursor().executemany("INSERT into " + table + " VALUES (" + ','.join('?' * len(cols)) + ")", cursor)
+
+    def empty_table(self, table):
+        obplayer.ObData.empty_table(self, table)
+        self.required_cache = None
+        self.groups_cache = { }
+        if table == 'shows':
+            self.show_versions = {}
+            self.shows_index = None
+
+    # save the database to disk. normally this is done in the background; with wait=True (ie. when shutting down)
+    # it's done right away.
+    def backup(self, wait=False):
+        if wait:
+            obplayer.Log.log('backup database to disk', 'data')
+            self.snapshot.snapshot(-1, 0)
+        else:
+            self.snapshot.request()
 
     def verify_backup(self):
-        # load our backup database from file. check integrity.  if the database doesn't exist, it will be created/empty - no problem, tables are checked/created below.
-        backup_icheck = []
-        backup = self.open_db(self.datadir + '/data.db')
-        for row in backup.cursor().execute('PRAGMA integrity_check'):
-            backup_icheck.extend(row)
-
-        if '\n'.join(backup_icheck) != 'ok':
+        # load our backup database from file. check the checksum and do a quick check.  if the database doesn't exist, it will be created/empty - no problem, tables are checked/created below.
+        if not check_snapshot(self, self.datadir + '/data.db'):
             obplayer.Log.log('backup file bad, ignoring.', 'data')
+            return
 
-        else:
-            obplayer.Log.log('restoring database from file', 'data')
-            with self.db.backup('main', backup, 'main') as backup:
-                backup.step()
-            obplayer.Log.log('done restoring database', 'data')
-
+        obplayer.Log.log('restoring database from file', 'data')
+        backup = self.open_db(self.datadir + '/data.db')
+        with self.db.backup('main', backup, 'main') as restore:
+            restore.step()
         backup.close()
+        obplayer.Log.log('done restoring database', 'data')
 
     def shows_create_table(self):
         self.execute('CREATE TABLE shows (id INTEGER PRIMARY KEY, show_id INTEGER, name TEXT, type TEXT, description TEXT, datetime NUMERIC UNIQUE, duration NUMERIC, last_updated NUMERIC)')
@@ -100,6 +279,54 @@ class ObRemoteData (obplayer.ObData):
     def alert_media_create_table(self):
         self.execute('CREATE TABLE alert_media (media_id INTEGER, filename TEXT, file_hash TEXT, file_size INT, language TEXT, event_name TEXT, media_type TEXT, PRIMARY KEY(media_id))')
 
+    #
+    # The media used by shows, live assist groups and priority broadcasts, with a count of the rows that use it.  It's
+    # kept up to date by triggers as those rows are added and removed, so finding the required media doesn't need
+    # a scan of all three tables.
+    #
+    def required_media_create_table(self):
+        self.execute('CREATE TABLE required_media (media_id INTEGER UNIQUE, filename TEXT, file_hash TEXT, file_location TEXT, approved INT, archived INT, file_size INT, media_type TEXT, refs INTEGER)')
+
+    #
+    # The triggers are replaced every time we start, so a database restored from a snapshot always has the current
+    # ones.  The insert trigger mustn't use INSERT or IGNORE: inside a trigger, the conflict handling of the statement
+    # that fired it (ie. the INSERT or REPLACE in priority_broadcast_addedit) takes over, which would replace the
+    # row and lose its count.
+    #
+    def required_media_create_triggers(self):
+        with self.db:
+            for table in [ 'shows_media', 'group_items', 'priority_broadcasts' ]:
+                self.execute('DROP TRIGGER IF EXISTS ' + table + '_required_insert')
+                self.execute('DROP TRIGGER IF EXISTS ' + table + '_required_delete')
+                self.execute('CREATE TRIGGER ' + table + '_required_insert AFTER INSERT ON ' + table + ' BEGIN '
+                    'INSERT into required_media (media_id, refs) SELECT NEW.media_id, 0 WHERE NOT EXISTS (SELECT 1 from required_media WHERE media_id=NEW.media_id); '
+                    'UPDATE required_media SET filename=NEW.filename, file_hash=NEW.file_hash, file_location=NEW.file_location, approved=NEW.approved, archived=NEW.archived, file_size=NEW.file_size, media_type=NEW.media_type, refs=refs + 1 WHERE media_id=NEW.media_id; '
+                    'END')
+                self.execute('CREATE TRIGGER ' + table + '_required_delete AFTER DELETE ON ' + table + ' BEGIN '
+                    'UPDATE required_media SET refs=refs - 1 WHERE media_id=OLD.media_id; '
+                    'DELETE from required_media WHERE media_id=OLD.media_id AND refs <= 0; '
+                    'END')
+
+    #
+    # Count the users of each media item from scratch and compare with required_media, rebuilding it if they don't
+    # match (ie. the table was just created, or was written by older triggers).  Returns True if it was correct.
+    #
+    def required_media_check(self):
+        columns = 'filename,media_id,file_hash,file_location,approved,archived,file_size,media_type'
+        users = 'SELECT ' + columns + ' from shows_media UNION ALL SELECT ' + columns + ' from group_items UNION ALL SELECT ' + columns + ' from priority_broadcasts'
+
+        expected = { row[0] : row[1] for row in self.execute('SELECT media_id,COUNT(*) from (' + users + ') GROUP by media_id') }
+        counted = { row[0] : row[1] for row in self.execute('SELECT media_id,refs from required_media') }
+        if expected == counted:
+            return True
+
+        obplayer.Log.log('required media counts are wrong, rebuilding', 'data')
+        with self.db:
+            self.execute('DELETE from required_media')
+            self.execute('INSERT into required_media (' + columns + ',refs) SELECT ' + columns + ',COUNT(*) from (' + users + ') GROUP by media_id')
+        self.required_cache = None
+        return False
+
     def priority_broadcasts_create_table(self):
         self.execute('CREATE TABLE priority_broadcasts (id INTEGER PRIMARY KEY, start_timestamp INTEGER, end_timestamp INTEGER, frequency INTEGER, filename TEXT, artist TEXT, title TEXT, duration NUMERIC, media_type TEXT, media_id INTEGER, file_hash TEXT, file_size INT, file_location TEXT, approved INT, archived INT)')
 
@@ -123,10 +350,10 @@ class ObRemoteData (obplayer.ObData):
                 return False
             else:
                 # if we have a match, but update is required, delete entry + associated media.
-                self.execute("DELETE from alert_media where media_id=?", (str(row[2]),))
+                self.write("DELETE from alert_media where media_id=?", (str(row[2]),))
 
         # now add the alert media... (media not added here, but added by sync script)
-        self.execute("INSERT or REPLACE into alert_media VALUES (?, ?, ?, ?, ?, ?, ?)", (media_id, filename, file_hash, file_size, "demo", event_name, media_type))
+        self.write("INSERT or REPLACE into alert_media VALUES (?, ?, ?, ?, ?, ?, ?)", (media_id, filename, file_hash, file_size, "demo", event_name, media_type))
         return self.db.last_insert_rowid()
 
     #
@@ -134,48 +361,59 @@ class ObRemoteData (obplayer.ObData):
     # Return false if edit not required.  Return lastrowid otherwise.
     #
     def show_addedit(self, show_id, name, show_type, description, datetime, duration, last_updated):
+        # if we already have this version of the show, there's nothing to do.
+        version = self.show_versions.get(int(datetime), None)
+        if version is not None and version[0] == int(show_id) and version[1] == int(last_updated) and version[2] == float(duration):
+            return False
+
         # determine whether there is already a show in this slot.
         rows = self.execute("SELECT show_id,last_updated,id,duration from shows where datetime=?", (str(datetime),))
         for row in rows:
             # if update not required, return false.
             if int(row[0]) == int(show_id) and int(row[1]) == int(last_updated) and float(row[3]) == float(duration):
+                self.show_versions[int(datetime)] = (int(show_id), int(last_updated), float(duration), row[2])
                 return False
             else:
-                # if we have a match, but update is required, delete entry + associated media.
-                self.execute("DELETE from shows_media where local_show_id=?", (str(row[2]),))
+                # if we have a match, but update is required, delete entry + associated media and groups.
+                self.write("DELETE from shows_media where local_show_id=?", (str(row[2]),))
+                self.group_remove_old(row[2])
 
         # now add the show... (media not added here, but added by sync script)
-        self.execute("INSERT or REPLACE into shows VALUES (null, ?, ?, ?, ?, ?, ?, ?)", (show_id, name, show_type, description, str(datetime), duration, str(last_updated)))
-        return self.db.last_insert_rowid()
+        self.write("INSERT or REPLACE into shows VALUES (null, ?, ?, ?, ?, ?, ?, ?)", (show_id, name, show_type, description, str(datetime), duration, str(last_updated)))
+        local_show_id = self.db.last_insert_rowid()
+        self.show_versions[int(datetime)] = (int(show_id), int(last_updated), float(duration), local_show_id)
+        return local_show_id
 
     #
     # Given a list of timestamps, delete all shows with a timestamp not in this list.  (Clean out shows that have been removed).
     # DO NOT remove shows within starting within 'ignore_limit' (since these fall within 'showlock').
     #
     def show_remove_deleted(self, timestamps, ignore_limit):
-        id_list_string = ','.join(str(timestamp) for timestamp in timestamps)
-        rows = self.query("SELECT id from shows WHERE datetime NOT IN (" + id_list_string + ") and datetime > " + str(ignore_limit))
-
-        for row in rows:
-            self.execute("DELETE from shows where id = " + str(row['id']))
-            self.execute("DELETE from shows_media where local_show_id = " + str(row['id']))
+        timestamps = set(int(timestamp) for timestamp in timestamps)
+        self.show_remove([ datetime for datetime in self.show_versions if datetime not in timestamps and datetime > ignore_limit ])
         return True
 
     # remove shows that are over, and associated media.
     def show_remove_old(self):
-        rows = self.query("SELECT id from shows WHERE (datetime+duration) < " + str(time.time()))
-
-        for row in rows:
-            self.execute("DELETE from shows where id = " + str(row['id']))
-            self.execute("DELETE from shows_media where local_show_id = " + str(row['id']))
+        present_time = time.time()
+        self.show_remove([ datetime for (datetime, version) in self.show_versions.items() if datetime + version[2] < present_time ])
         return True
 
+    # remove the shows starting at each of the given times, and their media.
+    def show_remove(self, datetimes):
+        local_show_ids = [ (self.show_versions.pop(datetime)[3],) for datetime in datetimes ]
+        if not local_show_ids:
+            return
+        self.executemany("DELETE from shows where id = ?", local_show_ids)
+        self.executemany("DELETE from shows_media where local_show_id = ?", local_show_ids)
+        self.executemany("DELETE from group_items where group_id IN (SELECT id from groups WHERE local_show_id = ?)", local_show_ids)
+        self.executemany("DELETE from groups where local_show_id = ?", local_show_ids)
+
     #
     # Given broadcast_id, start time, end time ('' for none), frequency, artist, title, filename, media_id, duration, and media type, update priority broadcast database.
     # If row with broadcast_id exists, it will be updated.  Otherwise row will be added.
     #
     def priority_broadcast_addedit(self, broadcast_id, start, end, frequency, artist, title, filename, media_id, duration, media_type, file_hash, file_size, file_location, approved, archived):
-        query = "INSERT OR REPLACE into priority_broadcasts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
         bindings = (
             broadcast_id,
             start, end,
@@ -192,15 +430,19 @@ class ObRemoteData (obplayer.ObData):
             approved,
             archived)
 
-        self.execute(query, bindings)
+        # if we already have this version of the broadcast, there's nothing to do.
+        for row in self.execute("SELECT id from priority_broadcasts WHERE id IS ? AND start_timestamp IS ? AND end_timestamp IS ? AND frequency IS ? AND filename IS ? AND artist IS ? AND title IS ? AND duration IS ? AND media_type IS ? AND media_id IS ? AND file_hash IS ? AND file_size IS ? AND file_location IS ? AND approved IS ? AND archived IS ?", bindings):
+            return False
+
+        self.write("INSERT OR REPLACE into priority_broadcasts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", bindings)
         return self.db.last_insert_rowid()
 
     #
     # Given a list of priority broadcast IDs, remove anything that isn't in there. (they are no longer needed.)
     #
     def priority_broadcast_remove_deleted(self, id_list):
-        id_list_string = ','.join(str(broadcast_id) for broadcast_id in id_list)
-        self.execute("DELETE from priority_broadcasts WHERE id NOT IN (" + id_list_string + ")")
+        id_list = list(id_list)
+        self.write("DELETE from priority_broadcasts WHERE id NOT IN (" + ','.join('?' * len(id_list)) + ")", id_list)
         return True
 
     #
@@ -225,17 +467,15 @@ class ObRemoteData (obplayer.ObData):
             media_item['approved'],
             media_item['archived'])
 
-        self.execute(query, bindings)
+        self.write(query, bindings)
         return self.db.last_insert_rowid()
 
     def group_remove_old(self, local_show_id):
-        rows = self.query("SELECT id from groups WHERE local_show_id = " + str(local_show_id))
-        for row in rows:
-            self.execute("DELETE from group_items where group_id = " + str(row['id']))
-            self.execute("DELETE from groups where id = " + str(row['id']))
+        self.write("DELETE from group_items where group_id IN (SELECT id from groups WHERE local_show_id = ?)", (local_show_id,))
+        self.write("DELETE from groups where local_show_id = ?", (local_show_id,))
 
     def group_add(self, local_show_id, name):
-        self.execute("INSERT into groups VALUES (null, ?, ?)", (str(local_show_id), name))
+        self.write("INSERT into groups VALUES (null, ?, ?)", (str(local_show_id), name))
         return self.db.last_insert_rowid()
 
     def group_item_add(self, group_id, media_item):
@@ -255,54 +495,70 @@ class ObRemoteData (obplayer.ObData):
             media_item['approved'],
             media_item['archived'])
 
-        self.execute(query, bindings)
+        self.write(query, bindings)
         return self.db.last_insert_rowid()
 
     #
     # Return a dictionary (associate array) of format returned_list[filename]=media_id for all media required by remote.
-    # This is based on the entries in shows_media and priority_broadcasts.
+    # This comes from the required_media table, and is only read again after a new schedule or set of priority
+    # broadcasts has been swapped in, so the same dictionary is returned until then.  Don't modify it.
     #
     def media_required(self):
-        rows = self.execute("SELECT filename,media_id,file_hash,file_location,approved,archived,file_size,media_type from shows_media GROUP by media_id")
+        media_list = self.required_cache
+        generation = self.generation
+        if media_list is not None and self.required_generation == generation:
+            return media_list
 
         media_list = {}
-
-        for row in rows:
+        for row in self.live_db.cursor().execute("SELECT filename,media_id,file_hash,file_location,approved,archived,file_size,media_type from required_media"):
             media_row = self.get_media_from_row(row)
             media_list[media_row['filename']] = media_row
 
-        rows = self.execute("SELECT filename,media_id,file_hash,file_location,approved,archived,file_size,media_type from priority_broadcasts GROUP by media_id")
+        self.required_cache = media_list
+        self.required_generation = generation
+        return media_list
 
-        for row in rows:
-            media_row = self.get_media_from_row(row)
-            media_list[media_row['filename']] = media_row
+    #
+    # Return a dictionary of media_id => the earliest time the media is due to be played, for media that is still to come.
+    # Live assist group media is due when its show starts, and priority broadcast media when the broadcast starts.
+    #
+    def media_air_times(self):
+        present_time = time.time()
+        air_times = {}
 
-        rows = self.execute("SELECT filename,media_id,file_hash,file_location,approved,archived,file_size,media_type from group_items GROUP by media_id")
+        def add_air_time(media_id, air_time):
+            air_time = max(float(air_time), present_time)
+            if media_id not in air_times or air_time < air_times[media_id]:
+                air_times[media_id] = air_time
 
-        for row in rows:
-            media_row = self.get_media_from_row(row)
-            media_list[media_row['filename']] = media_row
+        for row in self.execute("SELECT shows_media.media_id, MIN(shows.datetime + shows_media.offset) from shows_media JOIN shows ON shows.id = shows_media.local_show_id WHERE shows.datetime + shows_media.offset + shows_media.duration > ? GROUP by shows_media.media_id", (present_time,)):
+            add_air_time(row[0], row[1])
 
-        return media_list
+        for row in self.execute("SELECT group_items.media_id, MIN(shows.datetime) from group_items JOIN groups ON groups.id = group_items.group_id JOIN shows ON shows.id = groups.local_show_id WHERE shows.datetime + shows.duration > ? GROUP by group_items.media_id", (present_time,)):
+            add_air_time(row[0], row[1])
+
+        for row in self.execute("SELECT media_id, MIN(start_timestamp) from priority_broadcasts WHERE end_timestamp IS NULL OR end_timestamp = '' OR end_timestamp = 0 OR end_timestamp > ? GROUP by media_id", (present_time,)):
+            add_air_time(row[0], row[1])
+
+        return air_times
 
     def get_media_info(self, media_id):
-        for media in self.media_required():
-            print(media)
-            if media['media_id'] == media_id:
-                return media
+        for row in self.execute("SELECT filename,media_id,file_hash,file_location,approved,archived,file_size,media_type from required_media WHERE media_id=?", (media_id,)):
+            return self.get_media_from_row(row)
         return None
 
     def alert_media_required(self):
-        import json, requests, time
+        import json, requests
         postfields = {}
         postfields['id'] = obplayer.Config.setting('sync_device_id')
         postfields['pw'] = obplayer.Config.setting('sync_device_password')
 
         data_request = requests.post(obplayer.Config.setting('sync_url').replace('/remote.php', '/modules/alert_languages/remote.php'), data=postfields)
         data = json.loads(data_request.content.decode('utf-8'))
-        for media_item in data[2]['Demo Language']:
-            #print(media_item)
-            self.alert_audio_addedit(media_item['media_id'], media_item['alert_name'].lower() + '.' + media_item['media_format'], media_item['media_hash'], media_item['media_filesize'], media_item['alert_name'], media_item['media_type'])
+        with self.shadow([ 'alert_media' ]):
+            for media_item in data[2]['Demo Language']:
+                #print(media_item)
+                self.alert_audio_addedit(media_item['media_id'], media_item['alert_name'].lower() + '.' + media_item['media_format'], media_item['media_hash'], media_item['media_filesize'], media_item['alert_name'], media_item['media_type'])
         # for language_code in obplayer.Config.setting('alerts_selected_first_nations_languages').split(','):
         #     if language_code == 'cr-CA':
         #        language = 'cree'
@@ -349,63 +605,76 @@ class ObRemoteData (obplayer.ObData):
         media_row['media_type'] = row[6]
         return media_row
 
+    #
+    # Return the index of the shows in the live database, building it first if the schedule has changed.  The
+    # generation is read before the database, so if a new schedule is swapped in while we're building, the index
+    # will be rebuilt again next time rather than being kept with the wrong generation.
+    #
+    def show_index(self):
+        index = self.shows_index
+        generation = self.generation
+        if index is None or index.generation != generation:
+            rows = self.query_db(self.live_db, "SELECT * from shows")
+            index = ObShowIndex(rows, generation)
+            self.shows_index = index
+        return index
+
     #
     # Given the present time, return the present show (associate array/dictionary).
     #
     def get_present_show(self, present_timestamp):
-
-        rows = self.query("SELECT * from shows where datetime <= " + str(present_timestamp) + " order by datetime desc limit 1")
-
-        for (rindex, row) in enumerate(rows):
-
-            show_start_timestamp = row['datetime']
-            show_end_timestamp = show_start_timestamp + float(row['duration'])
-
-            if present_timestamp < show_end_timestamp:
-                rows[rindex]['start_time'] = show_start_timestamp
-                rows[rindex]['end_time'] = show_end_timestamp
-                return rows[rindex]
-
-        return None
+        return self.show_index().present(present_timestamp)
 
     #
     # Given the present time, return the next show.  Returned as associative array/dictionary.
     #
     def get_next_show_times(self, present_timestamp):
+        shows = self.show_index().upcoming(present_timestamp, 1)
+        return shows[0] if shows else None
 
-        rows = self.query("SELECT datetime,duration from shows where datetime > " + str(present_timestamp) + " order by datetime limit 1")
-
-        for (rindex, row) in enumerate(rows):
-
-            show_start_timestamp = row['datetime']
-            show_end_timestamp = show_start_timestamp + float(row['duration'])
-
-            if present_timestamp < show_end_timestamp:
-                rows[rindex]['start_time'] = show_start_timestamp
-                rows[rindex]['end_time'] = show_end_timestamp
-                return rows[rindex]
-
-        return None
+    #
+    # Given the present time, return the present show, the next count shows, and the gaps between shows (with their
+    # length) in the given number of seconds from now.
+    #
+    def get_schedule_overview(self, present_timestamp, count=10, duration=86400):
+        index = self.show_index()
+        data = { }
+        data['present'] = index.present(present_timestamp)
+        data['upcoming'] = index.upcoming(present_timestamp, count)
+        data['gaps'] = [ { 'start' : start, 'end' : end, 'duration' : end - start } for (start, end) in index.find_gaps(present_timestamp, present_timestamp + duration) ]
+        data['unscheduled'] = sum(gap['duration'] for gap in data['gaps'])
+        return data
 
+    #
+    # Return the live assist groups for a show, each with its list of items.  The groups and their items are loaded
+    # with a single query, and kept until a new schedule is swapped in, so the same (read-only) rows are returned
+    # for the show until then.
+    #
     def load_groups(self, local_show_id):
+        generation = self.generation
+        if self.groups_generation != generation:
+            self.groups_cache = { }
+            self.groups_generation = generation
 
-        group_rows = self.query("SELECT * from groups WHERE local_show_id = " + str(local_show_id))
-
-        groups = [ ]
-        for group_row in group_rows:
-            item_rows = self.query("SELECT * from group_items WHERE group_id = " + str(group_row['id']))
+        groups = self.groups_cache.get(local_show_id, None)
+        if groups is not None:
+            return groups
 
-            group_items = [ ]
-            for item_row in item_rows:
-                group_items.append(item_row)
+        rows = self.live_db.cursor().execute("SELECT groups.id,groups.local_show_id,groups.name," + ','.join('group_items.' + column for column in ObGroupItem.__slots__) + " from groups LEFT JOIN group_items ON group_items.group_id = groups.id WHERE groups.local_show_id = ? ORDER by groups.id, group_items.id", (local_show_id,))
 
-            groups.append({ 'id' : group_row['id'], 'local_show_id' : group_row['local_show_id'], 'name' : group_row['name'], 'items' : group_items })
+        groups = [ ]
+        for row in rows:
+            if not groups or groups[-1].id != row[0]:
+                groups.append(ObGroup((row[0], row[1], row[2], [ ])))
+            if row[3] is not None:
+                groups[-1].items.append(ObGroupItem(row[3:]))
 
         # TODO I've moved this to sync, and only liveassist shows will have these available
         #groups.append({ 'id' : -1, 'local_show_id' : -1, 'name' : 'System Requests', 'items' : [
         #    { 'id': -1, 'artist': 'System', 'title': "Line-In Audio Source", 'media_type': 'linein', 'duration': 3600, 'media_id': -1, 'order_num': -1, 'file_location': '', 'filename': '' },
         #    { 'id': -1, 'artist': 'System', 'title': "RTP Audio Source", 'media_type': 'rtp', 'duration': 3600, 'media_id': -1, 'order_num': -1, 'file_location': '', 'filename': '' }
         #] })
+        self.groups_cache[local_show_id] = groups
         return groups
 
     #
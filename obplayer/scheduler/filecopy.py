@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Copyright 2012-2015 OpenBroadcaster, Inc.
+
+This file is part of OpenBroadcaster Player.
+
+OpenBroadcaster Player is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+OpenBroadcaster Player is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with OpenBroadcaster Player.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import errno
+import shutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# ioctl to share the data of one file with another on btrfs/xfs (from linux/fs.h)
+FICLONE = 0x40049409
+
+COPY_BLOCK_SIZE = 1048576
+
+
+#
+# Copy a media file from src to dst, using the cheapest method that works: a hardlink if both are on the same
+# filesystem, a reflink on filesystems that support it, an in-kernel copy (copy_file_range or sendfile), and
+# finally an ordinary buffered copy.  Any existing dst is replaced.  Returns the name of the method used.
+#
+def copy_media_file(src, dst):
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    try:
+        os.link(src, dst)
+        return 'hardlink'
+    except (OSError, AttributeError):
+        pass
+
+    with open(src, 'rb') as fsrc:
+        with open(dst, 'wb') as fdst:
+            size = os.fstat(fsrc.fileno()).st_size
+
+            for method, copy_function in [ ('reflink', copy_reflink), ('copy_file_range', copy_range), ('sendfile', copy_sendfile) ]:
+                try:
+                    if copy_function(fsrc, fdst, size):
+                        break
+                except OSError as e:
+                    if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF, errno.EPERM):
+                        raise
+                # start over with the next method
+                fdst.seek(0)
+                fdst.truncate()
+            else:
+                method = 'copy'
+                fsrc.seek(0)
+                shutil.copyfileobj(fsrc, fdst, COPY_BLOCK_SIZE)
+
+    shutil.copymode(src, dst)
+    return method
+
+def copy_reflink(fsrc, fdst, size):
+    if fcntl is None:
+        return False
+    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    return True
+
+def copy_range(fsrc, fdst, size):
+    if not hasattr(os, 'copy_file_range'):
+        return False
+    offset = 0
+    while offset < size:
+        count = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - offset, offset, offset)
+        if count == 0:
+            return False
+        offset += count
+    return True
+
+def copy_sendfile(fsrc, fdst, size):
+    if not hasattr(os, 'sendfile'):
+        return False
+    offset = 0
+    while offset < size:
+        count = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, size - offset)
+        if count == 0:
+            return False
+        offset += count
+    return True
@@ -0,0 +1,470 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Copyright 2012-2015 OpenBroadcaster, Inc.
+
+This file is part of OpenBroadcaster Player.
+
+OpenBroadcaster Player is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+OpenBroadcaster Player is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with OpenBroadcaster Player.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import obplayer
+
+import os
+import sys
+import time
+import errno
+import struct
+import ctypes
+import select
+import threading
+import collections
+
+from .blobstore import BLOB_DIR
+
+
+# each time a file has been played counts the same as it having been used this much more recently (in seconds)
+PLAY_WEIGHT = 86400
+PLAY_COUNT_LIMIT = 14
+
+
+#
+# Index of the files in the remote media directory, as relative path => (size, mtime, media_id).  The directory is
+# scanned once, and then kept up to date as media is downloaded or removed, so finding unused media is a set
+# difference rather than a walk of the whole tree.  Unused files are deleted in the background at a limited rate
+# (sync_media_gc_rate files per second) to avoid I/O spikes during playout.  If a cache size is set, unused files
+# are kept until space is needed, so media that comes back into rotation doesn't have to be downloaded again.
+#
+class ObMediaIndex (object):
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        self.files = None
+
+        self.required = set()
+        self.delete_queue = collections.deque()
+        self.delete_thread = None
+        self.deleted_count = 0
+
+        # relative path => [ last time played or scheduled, play count ], for choosing what to evict
+        self.usage = { }
+        self.hits = 0
+        self.misses = 0
+
+        # set while ObMediaWatcher is keeping the index current, so it can be trusted for check_media()
+        self.watching = False
+
+    def relpath(self, path):
+        if path.startswith(self.root + '/'):
+            return path[len(self.root) + 1:]
+        return None
+
+    #
+    # Return the path of media relative to the remote media directory, or None if the media is stored elsewhere.
+    #
+    @staticmethod
+    def media_relpath(media):
+        file_location = media['file_location']
+        if not file_location or '/' in file_location:
+            return None
+        return file_location[0] + '/' + file_location[1] + '/' + media['filename']
+
+    #
+    # Build the index from scratch using scandir.
+    #
+    def scan(self):
+        files = { }
+        dirs = [ '' ]
+        while dirs:
+            reldir = dirs.pop()
+            try:
+                entries = list(os.scandir(self.root + '/' + reldir if reldir else self.root))
+            except OSError:
+                obplayer.Log.log('unable to scan media directory: ' + self.root + '/' + reldir, 'error')
+                continue
+
+            for entry in entries:
+                # the media store is cleaned up separately (see ObBlobStore)
+                if not reldir and entry.name == BLOB_DIR:
+                    continue
+
+                relpath = reldir + '/' + entry.name if reldir else entry.name
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(relpath)
+                    else:
+                        stat = entry.stat()
+                        files[relpath] = (stat.st_size, stat.st_mtime, None)
+                except OSError:
+                    pass
+
+        with self.lock:
+            # keep any media ids we already know about
+            if self.files:
+                for relpath, info in self.files.items():
+                    if relpath in files and info[2] is not None:
+                        files[relpath] = files[relpath][:2] + (info[2],)
+            self.files = files
+
+        obplayer.Log.log('indexed ' + str(len(files)) + ' files in ' + self.root, 'sync')
+
+    #
+    # Update the entry for a single file after it has been written, renamed or deleted.
+    #
+    def update(self, path, media_id=None):
+        relpath = self.relpath(path)
+        if relpath is None:
+            return
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stat = None
+
+        with self.lock:
+            if self.files is None:
+                return
+            if stat is None:
+                self.files.pop(relpath, None)
+            else:
+                if media_id is None and relpath in self.files:
+                    media_id = self.files[relpath][2]
+                self.files[relpath] = (stat.st_size, stat.st_mtime, media_id)
+
+    #
+    # Drop the entries for everything below a directory which has been removed or moved away.
+    #
+    def remove_tree(self, reldir):
+        with self.lock:
+            if self.files is None:
+                return
+            for relpath in [ relpath for relpath in self.files if relpath.startswith(reldir + '/') ]:
+                del self.files[relpath]
+
+    def get(self, path):
+        relpath = self.relpath(path)
+        with self.lock:
+            if self.files is None or relpath is None:
+                return None
+            return self.files.get(relpath, None)
+
+    #
+    # Return True if the file at path is in the index with the given size, False if it isn't, or None if the index
+    # isn't being kept current (in which case the caller should check the file itself).
+    #
+    def available(self, path, size):
+        if not self.watching:
+            return None
+        relpath = self.relpath(path)
+        if relpath is None:
+            return None
+        with self.lock:
+            if self.files is None:
+                return None
+            info = self.files.get(relpath, None)
+            return info is not None and info[0] == size
+
+    #
+    # Record the media needed by the schedule (from RemoteData.media_required()) and which of it had to be fetched,
+    # to keep the cache hit and miss counts.  Media that is newly required counts as a hit if it was still on disk.
+    # Required media is marked as used at its next air time (or now) so it's the last to go once it's unreferenced.
+    #
+    def set_required(self, media_required, fetch_list):
+        air_times = obplayer.RemoteData.media_air_times()
+        present_time = time.time()
+
+        required = set()
+        for media in media_required.values():
+            relpath = self.media_relpath(media)
+            if relpath is not None:
+                required.add(relpath)
+                required.add(relpath + '.part')
+
+        missing = set(self.media_relpath(media) for media in fetch_list)
+
+        with self.lock:
+            for media in media_required.values():
+                relpath = self.media_relpath(media)
+                if relpath is None or media['media_type'] not in [ 'audio', 'video', 'image' ]:
+                    continue
+                if relpath not in self.required:
+                    if relpath in missing:
+                        self.misses += 1
+                    else:
+                        self.hits += 1
+
+                last_used = air_times.get(media['media_id'], present_time)
+                usage = self.usage.get(relpath, None)
+                if usage is None:
+                    self.usage[relpath] = [ last_used, 0 ]
+                elif usage[0] < last_used:
+                    usage[0] = last_used
+
+            self.required = required
+
+    #
+    # Note that a media file has been played, for the cache eviction score.
+    #
+    def touch(self, path):
+        relpath = self.relpath(path)
+        if relpath is None:
+            return
+        with self.lock:
+            usage = self.usage.setdefault(relpath, [ 0, 0 ])
+            usage[0] = max(usage[0], time.time())
+            usage[1] += 1
+
+    #
+    # The higher the score, the longer an unreferenced file is kept: the last time it was played or scheduled (or
+    # written, if we don't know), plus a bonus for each time it has been played.
+    #
+    def eviction_score(self, relpath):
+        usage = self.usage.get(relpath, None)
+        if usage is None:
+            return self.files[relpath][1]
+        return max(usage[0], self.files[relpath][1]) + min(usage[1], PLAY_COUNT_LIMIT) * PLAY_WEIGHT
+
+    #
+    # Queue indexed files which aren't required (see set_required) for deletion.  With no cache size set, every
+    # unused file goes; otherwise unused files are kept until the total size goes over sync_media_cache_size MB,
+    # and then the lowest scoring ones go first.  Partial downloads of required media are kept so they can be resumed.
+    #
+    def remove_unused(self):
+        if self.files is None:
+            self.scan()
+
+        cache_size = obplayer.Config.setting('sync_media_cache_size') * 1048576
+
+        with self.lock:
+            queued = set(self.delete_queue)
+            unused = set(self.files) - self.required - queued
+
+            if cache_size > 0:
+                total_size = sum(info[0] for relpath, info in self.files.items() if relpath not in queued)
+                evict = [ ]
+                for relpath in sorted(unused, key=self.eviction_score):
+                    if total_size <= cache_size:
+                        break
+                    evict.append(relpath)
+                    total_size -= self.files[relpath][0]
+                unused = evict
+
+            self.delete_queue.extend(sorted(unused))
+
+            if not self.delete_queue or (self.delete_thread and self.delete_thread.is_alive()):
+                return
+            self.delete_thread = threading.Thread(target=self.delete_worker, name='SyncMediaCleanup')
+            self.delete_thread.daemon = True
+            self.delete_thread.start()
+
+    def delete_worker(self):
+        rate = obplayer.Config.setting('sync_media_gc_rate')
+
+        while not obplayer.Sync.quit:
+            with self.lock:
+                if not self.delete_queue:
+                    self.delete_thread = None
+                    return
+                relpath = self.delete_queue.popleft()
+
+                # the media may have been scheduled again since it was queued
+                if relpath in self.required:
+                    continue
+
+            path = self.root + '/' + relpath
+            obplayer.Log.log('deleting unused media: ' + path, 'sync')
+            try:
+                os.remove(path)
+            except OSError:
+                if os.path.exists(path):
+                    obplayer.Log.log('unable to remove media: ' + path, 'error')
+
+            with self.lock:
+                self.files.pop(relpath, None)
+                self.usage.pop(relpath, None)
+                self.deleted_count += 1
+
+            if rate > 0:
+                time.sleep(1.0 / rate)
+
+    def get_status(self):
+        with self.lock:
+            data = { }
+            data['files'] = len(self.files) if self.files is not None else None
+            data['bytes'] = sum(info[0] for info in self.files.values()) if self.files is not None else None
+            data['delete_pending'] = len(self.delete_queue)
+            data['deleted'] = self.deleted_count
+            data['watching'] = self.watching
+            data['cache_size'] = obplayer.Config.setting('sync_media_cache_size') * 1048576
+            data['unused_bytes'] = sum(info[0] for relpath, info in self.files.items() if relpath not in self.required) if self.files is not None else None
+            data['hits'] = self.hits
+            data['misses'] = self.misses
+            return data
+
+
+# inotify constants (from linux/inotify.h)
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+#
+# Keeps an ObMediaIndex current using inotify, so that check_media() can look files up in memory instead of
+# stat'ing them on every call.  Only changes made through this machine's kernel are seen, so on network mounts the
+# index relies on the player being the one that writes to the media directory.  If inotify isn't available, the
+# index is never marked as being watched and check_media() goes back to checking the files directly.
+#
+class ObMediaWatcher (obplayer.ObThread):
+    def __init__(self, index):
+        obplayer.ObThread.__init__(self)
+        self.daemon = True
+        self.index = index
+        self.libc = None
+        self.fd = None
+
+        # watch descriptor => directory relative to the index root
+        self.watches = { }
+
+    def try_run(self):
+        if not sys.platform.startswith('linux'):
+            self.index.scan()
+            return
+
+        try:
+            self.libc = ctypes.CDLL(None, use_errno=True)
+            self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+            if self.fd < 0:
+                raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+            self.watch_all()
+            if '' not in self.watches.values():
+                raise OSError(errno.ENOENT, 'media directory ' + self.index.root + ' does not exist')
+            self.index.scan()
+            self.index.watching = True
+
+            while not self.stopflag.is_set():
+                ready, _, _ = select.select([ self.fd ], [ ], [ ], 1)
+                if ready:
+                    self.read_events()
+        except (OSError, AttributeError) as e:
+            obplayer.Log.log('unable to watch media directory for changes, checking files directly: ' + str(e), 'warning')
+            if self.index.files is None:
+                self.index.scan()
+        finally:
+            self.index.watching = False
+            if self.fd is not None and self.fd >= 0:
+                os.close(self.fd)
+                self.fd = None
+
+    def add_watch(self, reldir):
+        path = self.index.root + '/' + reldir if reldir else self.index.root
+        wd = self.libc.inotify_add_watch(self.fd, path.encode('utf-8'), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise OSError(error, 'unable to watch ' + path)
+        self.watches[wd] = reldir
+
+    #
+    # Add watches for the root and every directory below it, except the media store.
+    #
+    def watch_all(self):
+        self.watches = { }
+        dirs = [ '' ]
+        while dirs:
+            reldir = dirs.pop()
+            self.add_watch(reldir)
+            try:
+                entries = list(os.scandir(self.index.root + '/' + reldir if reldir else self.index.root))
+            except OSError:
+                continue
+            for entry in entries:
+                if not reldir and entry.name == BLOB_DIR:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(reldir + '/' + entry.name if reldir else entry.name)
+
+    def read_events(self):
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                return
+            raise
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+            name = data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b'\0').decode('utf-8', 'replace')
+            offset += INOTIFY_EVENT.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                # we've missed events, so start over
+                obplayer.Log.log('media directory watch queue overflowed, rescanning', 'sync')
+                for old_wd in list(self.watches.keys()):
+                    self.libc.inotify_rm_watch(self.fd, old_wd)
+                self.watch_all()
+                self.index.scan()
+                continue
+
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+
+            reldir = self.watches.get(wd, None)
+            if reldir is None or not name:
+                continue
+            relpath = reldir + '/' + name if reldir else name
+
+            if mask & IN_ISDIR:
+                if not reldir and name == BLOB_DIR:
+                    continue
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.watch_directory(relpath)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self.index.remove_tree(relpath)
+                continue
+
+            self.index.update(self.index.root + '/' + relpath)
+
+    #
+    # Start watching a newly created directory, and index anything that was put in it before the watch was added.
+    #
+    def watch_directory(self, relpath):
+        self.add_watch(relpath)
+        try:
+            entries = list(os.scandir(self.index.root + '/' + relpath))
+        except OSError:
+            return
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                self.watch_directory(relpath + '/' + entry.name)
+            else:
+                self.index.update(entry.path)
@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Copyright 2012-2015 OpenBroadcaster, Inc.
+
+This file is part of OpenBroadcaster Player.
+
+OpenBroadcaster Player is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+OpenBroadcaster Player is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with OpenBroadcaster Player.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import obplayer
+
+import time
+import heapq
+import threading
+
+
+# weight given to the most recent download when updating the measured download rate
+RATE_SMOOTHING = 0.3
+
+# downloads that have been running for less than this many seconds don't have a useful rate yet
+RATE_MIN_TIME = 5
+
+
+#
+# Orders media downloads by the time each file is first needed on air, and estimates when each download will
+# finish based on the measured download rate, so that we can warn early about media that will be late.  Until a
+# rate has been measured, it's taken from the bandwidth limit or the recent transfer rate, and the estimates are
+# updated as the downloads in progress report their rates.
+#
+class ObDownloadPlanner (object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.plan = [ ]
+
+        # measured download rate of a single worker, in bytes/second
+        self.worker_rate = 0
+
+    #
+    # Given a list of media rows (from RemoteData.media_required()), return them sorted earliest deadline first.
+    # Media with no known air time goes last.
+    #
+    def plan_downloads(self, media_list, num_workers):
+        air_times = obplayer.RemoteData.media_air_times()
+
+        plan = [ ]
+        for media in media_list:
+            plan.append({
+                'media' : media,
+                'media_id' : media['media_id'],
+                'filename' : media['filename'],
+                'file_size' : media['file_size'],
+                'deadline' : air_times.get(media['media_id'], None),
+                'eta' : None,
+                'late' : False
+            })
+        plan.sort(key=lambda item: (item['deadline'] is None, item['deadline'] or 0))
+
+        with self.lock:
+            self.plan = plan
+            late = self.estimate_completion(plan, num_workers)
+        self.warn_late(late)
+
+        return [ item['media'] for item in plan ]
+
+    #
+    # Called every so often while downloading, with the downloads (MediaDownloadProgress) in progress.  Updates the
+    # measured rate from them, and the estimates for what's left of the plan.
+    #
+    def update(self, downloads, num_workers):
+        present_time = time.time()
+        downloading = [ progress for progress in downloads if progress.status == 'downloading' ]
+        rates = [ progress.rate() for progress in downloading if present_time - progress.start_time >= RATE_MIN_TIME ]
+        rates = [ rate for rate in rates if rate > 0 ]
+        remaining = { progress.media['media_id'] : max(0, progress.total - progress.downloaded) for progress in downloading }
+
+        with self.lock:
+            if rates:
+                self.add_rate(sum(rates) / len(rates))
+            late = self.estimate_completion(self.plan, num_workers, remaining)
+        self.warn_late(late)
+
+    #
+    # Work out when each item should finish, assuming each goes to whichever worker is free first.  Items already
+    # downloading only have their remaining bytes (by media id) left to fetch.  Returns the items that have newly
+    # become late.
+    #
+    def estimate_completion(self, plan, num_workers, remaining=None):
+        rate = self.worker_rate if self.worker_rate > 0 else self.initial_rate(num_workers)
+        if rate <= 0:
+            return [ ]
+
+        late = [ ]
+        present_time = time.time()
+        workers = [ present_time ] * max(1, num_workers)
+        for item in plan:
+            size = remaining.get(item['media_id'], item['file_size']) if remaining else item['file_size']
+            start = heapq.heappop(workers)
+            item['eta'] = start + size / rate
+            was_late = item['late']
+            item['late'] = item['deadline'] is not None and item['eta'] > item['deadline']
+            if item['late'] and not was_late:
+                late.append(item)
+            heapq.heappush(workers, item['eta'])
+        return late
+
+    # a per-worker rate to start with, before any download has been measured: the bandwidth limit if there is one,
+    # or the rate we've been getting lately, shared between the workers.
+    @staticmethod
+    def initial_rate(num_workers):
+        status = obplayer.Sync.bandwidth.get_status()
+        return float(status['limit'] or status['rate']) / max(1, num_workers)
+
+    def add_rate(self, rate):
+        self.worker_rate = rate if self.worker_rate <= 0 else (RATE_SMOOTHING * rate) + ((1 - RATE_SMOOTHING) * self.worker_rate)
+
+    @staticmethod
+    def warn_late(late):
+        for item in late:
+            obplayer.Log.log('media ' + str(item['filename']) + ' is not expected to finish downloading before it airs at ' + time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(item['deadline'])), 'warning')
+
+    #
+    # Called by the download workers when a download has finished.
+    #
+    def complete(self, progress):
+        rate = progress.rate()
+        with self.lock:
+            if rate > 0 and progress.status == 'complete':
+                self.add_rate(rate)
+            self.plan = [ item for item in self.plan if item['media_id'] != progress.media['media_id'] ]
+
+    def get_deadline(self, media_id):
+        with self.lock:
+            for item in self.plan:
+                if item['media_id'] == media_id:
+                    return item['deadline']
+        return None
+
+    def get_plan(self):
+        with self.lock:
+            return [ { key: item[key] for key in item if key != 'media' } for item in self.plan ]
@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Copyright 2012-2015 OpenBroadcaster, Inc.
+
+This file is part of OpenBroadcaster Player.
+
+OpenBroadcaster Player is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+OpenBroadcaster Player is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with OpenBroadcaster Player.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import obplayer
+
+import os
+import re
+import sys
+import time
+import socket
+
+if sys.version.startswith('3'):
+    import socketserver as SocketServer
+    import http.server as BaseHTTPServer
+else:
+    import SocketServer
+    import BaseHTTPServer
+
+
+RANGE_REGEX = re.compile(r'^bytes=(\d+)-')
+
+READ_BLOCK_SIZE = 65536
+
+# how often to look for more data while waiting on the download
+POLL_INTERVAL = 0.1
+
+# give up on a download that hasn't written anything in this long
+STALL_TIMEOUT = 60
+
+
+#
+# Serves media that is still downloading to the player over http on the loopback interface, so that GStreamer can
+# start playing a file before it's complete.  The response has the full length of the file, and data is sent as it
+# is written to the .part file.  Whether it's safe to play a given download is decided by ObSync.progressive_uri().
+#
+class ObProgressiveServer (SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), ObProgressiveRequestHandler)
+        self.thread = None
+
+    def start(self):
+        self.thread = obplayer.ObThread('ObProgressiveServer', target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # shutdown() waits for serve_forever() to finish, which would be forever if it was never started
+    def stop(self):
+        if self.thread is not None:
+            self.shutdown()
+        self.server_close()
+
+    def uri(self, media_id):
+        return 'http://127.0.0.1:' + str(self.server_address[1]) + '/media/' + str(media_id)
+
+
+class ObProgressiveRequestHandler (BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        obplayer.Log.log('progressive playback: ' + format % args, 'debug')
+
+    def do_GET(self):
+        match = re.match(r'^/media/(\d+)$', self.path)
+        if not match:
+            self.send_error(404)
+            return
+        media_id = int(match.group(1))
+
+        # while it's downloading, send the .part file as it's written.  once it's done (the player can still seek or
+        # reconnect after that), send the finished file.
+        progress = obplayer.Sync.get_download(media_id)
+        if progress is not None and progress.part_filename is not None and os.path.exists(progress.part_filename):
+            filename = progress.part_filename
+            file_size = progress.media['file_size']
+        else:
+            progress = None
+            filename = self.completed_filename(media_id)
+            if filename is None:
+                self.send_error(404)
+                return
+            file_size = os.path.getsize(filename)
+
+        start = 0
+        match = RANGE_REGEX.match(self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            if start >= file_size:
+                self.send_error(416)
+                return
+
+        # once open, the file can be renamed into place without affecting us
+        with open(filename, 'rb') as f:
+            if start > 0:
+                self.send_response(206)
+                self.send_header('Content-Range', 'bytes ' + str(start) + '-' + str(file_size - 1) + '/' + str(file_size))
+            else:
+                self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(file_size - start))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.end_headers()
+
+            self.send_file(f, progress, start, file_size)
+
+    # the path of a media file that has finished downloading, or None if it isn't there
+    @staticmethod
+    def completed_filename(media_id):
+        media = obplayer.RemoteData.get_media_info(media_id)
+        if media is None or not media['file_location']:
+            return None
+        filename = obplayer.Sync.media_location(media['file_location']) + '/' + media['filename']
+        if not os.path.isfile(filename):
+            return None
+        return filename
+
+    def send_file(self, f, progress, position, file_size):
+        last_data = time.time()
+        while position < file_size:
+            f.seek(position)
+            data = f.read(min(READ_BLOCK_SIZE, file_size - position))
+            if data:
+                try:
+                    self.wfile.write(data)
+                except (socket.error, IOError):
+                    # the player stopped or seeked
+                    return
+                position += len(data)
+                last_data = time.time()
+                continue
+
+            # a finished file has nothing more coming
+            if progress is None:
+                break
+            if progress.status in [ 'failed', 'cancelled' ] or (progress.status == 'complete' and progress.end_time and time.time() - progress.end_time > 1):
+                break
+            if time.time() - last_data > STALL_TIMEOUT:
+                break
+            time.sleep(POLL_INTERVAL)
+
+        if position < file_size:
+            obplayer.Log.log('progressive playback of ' + os.path.basename(f.name) + ' ended early at byte ' + str(position), 'error')
+            self.close_connection = True
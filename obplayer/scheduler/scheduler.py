@@ -193,7 +193,11 @@ class ObShow (object):
             return False
 
         media = self.playlist.current()
-        if not media or not obplayer.Sync.check_media(media):
+        offset = present_time - self.show_data['start_time'] - media['offset'] if media else 0
+        available = media and obplayer.Sync.check_media(media)
+        uri = obplayer.Sync.progressive_uri(media, offset) if media and not available else None
+
+        if not available and uri is None:
             obplayer.Log.log("media not found at position " + str(self.playlist.current_pos()) + ": " + str(media['filename']) if media else '??', 'scheduler')
             next_start = self.playlist.next_start() if media else None
             self.next_media_update = self.start_time() + next_start if next_start else self.end_time()
@@ -201,14 +205,15 @@ class ObShow (object):
             self.ctrl.add_request(media_type='break', duration=2, title="media not found break")
             return False
 
-        offset = present_time - self.show_data['start_time'] - media['offset']
-        self.play_media(media, offset, present_time)
+        if uri:
+            obplayer.Log.log("playing " + str(media['filename']) + " while it downloads", 'scheduler')
+        self.play_media(media, offset, present_time, uri)
         next_start = self.playlist.next_start()
         self.next_media_update = self.start_time() + next_start if next_start else self.end_time()
 
         return True
 
-    def play_media(self, media, offset, present_time):
+    def play_media(self, media, offset, present_time, uri=None):
         self.now_playing = media
         self.pause_position = 0
         self.media_start_time = present_time - offset
@@ -226,7 +231,7 @@ class ObShow (object):
             self.ctrl.add_request(
                 start_time = self.media_start_time,
                 media_type = media['media_type'],
-                uri = obplayer.Sync.media_uri(media['file_location'], media['filename']),
+                uri = uri if uri else obplayer.Sync.media_uri(media['file_location'], media['filename']),
                 media_id = media['media_id'],
                 order_num = media['order_num'],
                 artist = media['artist'],
@@ -339,13 +344,18 @@ class ObLiveAssistShow (ObShow):
             return False
 
         media = self.playlist.current()
-        if not media or not obplayer.Sync.check_media(media):
+        available = media and obplayer.Sync.check_media(media)
+        uri = obplayer.Sync.progressive_uri(media) if media and not available else None
+
+        if not available and uri is None:
             obplayer.Log.log("media not found at position " + str(self.playlist.current_pos()) + ": " + str(media['filename']) if media else '??', 'scheduler')
             #self.ctrl.stop_requests()
             self.ctrl.add_request(media_type='break', duration=2, title="media not found break")
             return False
 
-        self.play_media(media, 0, present_time)
+        if uri:
+            obplayer.Log.log("playing " + str(media['filename']) + " while it downloads", 'scheduler')
+        self.play_media(media, 0, present_time, uri)
         return True
 
     def play_group_item(self, group_num, group_item_num, seek):
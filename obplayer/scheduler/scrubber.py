@@ -0,0 +1,218 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Copyright 2012-2015 OpenBroadcaster, Inc.
+
+This file is part of OpenBroadcaster Player.
+
+OpenBroadcaster Player is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+OpenBroadcaster Player is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with OpenBroadcaster Player.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import obplayer
+
+import os
+import sys
+import json
+import time
+import ctypes
+import hashlib
+import platform
+import traceback
+
+
+# how long to wait between passes over the media library
+SCRUB_INTERVAL = 3600
+
+# files that haven't changed are still re-hashed once they were last verified this long ago, to catch bit rot
+SCRUB_MAX_AGE = 30 * 86400
+
+# how often to save our progress
+CHECKPOINT_INTERVAL = 60
+
+READ_BLOCK_SIZE = 4194304
+
+# ioprio_set() syscall numbers and constants (from linux/ioprio.h)
+IOPRIO_SYSCALLS = { 'x86_64': 251, 'i386': 289, 'i686': 289, 'aarch64': 30, 'armv7l': 314, 'armv6l': 314 }
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+
+
+#
+# Put the calling thread in the idle I/O scheduling class, so that it only gets disk time no one else wants (the
+# same as 'ionice -c 3').  Returns True on success.
+#
+def set_idle_io_priority():
+    if not sys.platform.startswith('linux'):
+        return False
+    syscall_number = IOPRIO_SYSCALLS.get(platform.machine(), None)
+    if syscall_number is None:
+        return False
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        # a 'who' of 0 means the calling thread
+        return libc.syscall(syscall_number, IOPRIO_WHO_PROCESS, 0, IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT) == 0
+    except (OSError, AttributeError):
+        return False
+
+
+#
+# Re-hashes the required media in the background and compares it against file_hash, so that corrupt files are
+# found and downloaded again before they go to air.  Results are cached by (size, mtime) and saved to a checkpoint
+# file in the data directory, so unchanged files aren't hashed again after a restart.
+#
+class ObMediaScrubber (obplayer.ObThread):
+    def __init__(self):
+        obplayer.ObThread.__init__(self)
+        self.daemon = True
+        self.checkpoint_file = obplayer.ObData.get_datadir() + '/scrub.json'
+
+        # relative path => [ size, mtime, file_hash, time verified ]
+        self.results = { }
+        self.last_checkpoint = 0
+
+        self.current = None
+        self.verified_count = 0
+        self.corrupt_count = 0
+
+    def try_run(self):
+        if not obplayer.Config.setting('sync_media_scrub_enable'):
+            self.remove_thread()
+            return
+
+        if not set_idle_io_priority():
+            obplayer.Log.log('unable to set idle i/o priority for media scrubber', 'warning')
+
+        self.load_checkpoint()
+
+        # give the initial sync a head start
+        while not self.stopflag.wait(60):
+            try:
+                self.scrub()
+            except:
+                obplayer.Log.log("exception in " + self.name + " thread", 'error')
+                obplayer.Log.log(traceback.format_exc(), 'error')
+            self.save_checkpoint()
+
+            if self.stopflag.wait(SCRUB_INTERVAL):
+                break
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_file, 'r') as f:
+                self.results = json.load(f)['results']
+        except (IOError, OSError, ValueError, KeyError):
+            self.results = { }
+
+    def save_checkpoint(self):
+        self.last_checkpoint = time.time()
+        try:
+            with open(self.checkpoint_file + '.tmp', 'w') as f:
+                json.dump({ 'results': self.results }, f)
+            os.rename(self.checkpoint_file + '.tmp', self.checkpoint_file)
+        except (IOError, OSError):
+            obplayer.Log.log('unable to save media scrubber checkpoint ' + self.checkpoint_file, 'error')
+
+    #
+    # Make one pass over the required media, hashing anything that is new, changed or due to be checked again.
+    #
+    def scrub(self):
+        remote_media = obplayer.Config.setting('remote_media')
+        media_required = obplayer.RemoteData.media_required()
+
+        required = { }
+        for media in media_required.values():
+            relpath = obplayer.Sync.media_index.media_relpath(media)
+            if relpath is not None and media['file_hash'] and media['media_type'] in [ 'audio', 'video', 'image' ]:
+                required[relpath] = media
+
+        # forget about media we no longer have
+        for relpath in list(self.results.keys()):
+            if relpath not in required:
+                del self.results[relpath]
+
+        for relpath in sorted(required.keys()):
+            if self.stopflag.is_set():
+                return
+
+            media = required[relpath]
+            try:
+                stat = os.stat(remote_media + '/' + relpath)
+            except OSError:
+                continue
+
+            # incomplete files are left to sync_media
+            if stat.st_size != media['file_size']:
+                continue
+
+            result = self.results.get(relpath, None)
+            if result and result[0] == stat.st_size and result[1] == stat.st_mtime and result[2] == media['file_hash'] and time.time() - result[3] < SCRUB_MAX_AGE:
+                continue
+
+            self.current = relpath
+            file_hash = self.hash_file(remote_media + '/' + relpath)
+            self.current = None
+            if file_hash is None:
+                return
+
+            if file_hash == media['file_hash'].lower():
+                self.results[relpath] = [ stat.st_size, stat.st_mtime, media['file_hash'], time.time() ]
+                self.verified_count += 1
+            else:
+                obplayer.Log.log('media ' + relpath + ' failed hash check, queueing for download', 'error')
+                self.results.pop(relpath, None)
+                self.corrupt_count += 1
+                obplayer.Sync.redownload_media(media)
+
+            if time.time() - self.last_checkpoint >= CHECKPOINT_INTERVAL:
+                self.save_checkpoint()
+
+    #
+    # Return the md5 hash of a file, or None if we were stopped part way.  The file is read in large blocks, and
+    # dropped from the page cache as we go so that we don't push out media that is actually playing.
+    #
+    def hash_file(self, filename):
+        rate = obplayer.Config.setting('sync_media_scrub_rate') * 1048576
+        md5 = hashlib.md5()
+        offset = 0
+        start_time = time.time()
+
+        with open(filename, 'rb') as f:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+            for block in iter(lambda: f.read(READ_BLOCK_SIZE), b''):
+                if self.stopflag.is_set():
+                    return None
+                md5.update(block)
+
+                if hasattr(os, 'posix_fadvise'):
+                    os.posix_fadvise(f.fileno(), offset, len(block), os.POSIX_FADV_DONTNEED)
+                offset += len(block)
+
+                if rate > 0:
+                    delay = offset / float(rate) - (time.time() - start_time)
+                    if delay > 0 and self.stopflag.wait(delay):
+                        return None
+
+        return md5.hexdigest()
+
+    def get_status(self):
+        data = { }
+        data['verified'] = self.verified_count
+        data['corrupt'] = self.corrupt_count
+        data['cached'] = len(self.results)
+        data['current'] = self.current
+        return data
@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Copyright 2012-2015 OpenBroadcaster, Inc.
+
+This file is part of OpenBroadcaster Player.
+
+OpenBroadcaster Player is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+OpenBroadcaster Player is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with OpenBroadcaster Player.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import bisect
+
+
+#
+# A sorted index of the shows in the schedule, so that the present show, the shows coming up next, and the gaps
+# between shows can be found with a binary search instead of a database query.  The index is read-only once built;
+# a new one is built from the database whenever the schedule changes.
+#
+class ObShowIndex (object):
+    def __init__(self, rows, generation=None):
+        self.generation = generation
+        self.shows = [ ]
+        for row in sorted(rows, key=lambda row: row['datetime']):
+            show = dict(row)
+            show['start_time'] = show['datetime']
+            show['end_time'] = show['datetime'] + float(show['duration'])
+            self.shows.append(show)
+        self.starts = [ show['start_time'] for show in self.shows ]
+
+        # the unscheduled time between shows, as (start, end) pairs sorted by both.  shows can overlap, so a gap
+        # starts at the latest end time of all the shows before it.  the last gap has no end.
+        self.gaps = [ ]
+        gap_start = float('-inf')
+        for show in self.shows:
+            if show['start_time'] > gap_start:
+                self.gaps.append((gap_start, show['start_time']))
+            gap_start = max(gap_start, show['end_time'])
+        self.gaps.append((gap_start, float('inf')))
+        self.gap_ends = [ gap[1] for gap in self.gaps ]
+
+    def __len__(self):
+        return len(self.shows)
+
+    #
+    # Return the show playing at the given time, or None.  Like the schedule itself, the latest show to start
+    # before the given time is the one playing, if it hasn't ended.
+    #
+    def present(self, present_time):
+        pos = bisect.bisect_right(self.starts, present_time) - 1
+        if pos >= 0 and present_time < self.shows[pos]['end_time']:
+            return dict(self.shows[pos])
+        return None
+
+    # return the next count shows starting after the given time
+    def upcoming(self, present_time, count=1):
+        pos = bisect.bisect_right(self.starts, present_time)
+        return [ dict(show) for show in self.shows[pos:pos + count] ]
+
+    # return the gaps between shows that overlap the given time range, as (start, end) pairs clipped to the range
+    def find_gaps(self, start_time, end_time):
+        gaps = [ ]
+        for pos in range(bisect.bisect_right(self.gap_ends, start_time), len(self.gaps)):
+            (gap_start, gap_end) = self.gaps[pos]
+            if gap_start >= end_time:
+                break
+            gaps.append((max(gap_start, start_time), min(gap_end, end_time)))
+        return gaps
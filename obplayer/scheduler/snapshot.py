@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Copyright 2012-2015 OpenBroadcaster, Inc.
+
+This file is part of OpenBroadcaster Player.
+
+OpenBroadcaster Player is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+OpenBroadcaster Player is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with OpenBroadcaster Player.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import obplayer
+
+import os
+import apsw
+import time
+import hashlib
+import threading
+
+
+# pages copied per backup step, and the pause between steps, so that a snapshot never holds the database for long
+SNAPSHOT_STEP_PAGES = 64
+SNAPSHOT_STEP_DELAY = 0.01
+
+# how often to check for changes that weren't followed by a snapshot request (ie. priority broadcast updates)
+SNAPSHOT_INTERVAL = 600
+
+
+def file_md5(filename):
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1048576), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+#
+# Check that a snapshot file is safe to restore from.  If its checksum matches the one saved with it, a quick_check
+# is enough.  If it doesn't (the checksum is renamed into place separately, so a crash in between leaves a good
+# database with the old checksum), or there is no checksum, the database gets a full integrity_check instead of
+# being thrown away.  Returns True if the file is good.
+#
+def check_snapshot(data, filename):
+    if not os.path.exists(filename):
+        return True
+
+    check = 'PRAGMA integrity_check'
+    checksum_filename = filename + '.md5'
+    if os.path.exists(checksum_filename):
+        with open(checksum_filename, 'r') as f:
+            checksum = f.read().strip()
+        if file_md5(filename) == checksum:
+            check = 'PRAGMA quick_check'
+        else:
+            obplayer.Log.log('snapshot ' + filename + ' does not match its checksum, doing a full check', 'data')
+
+    db = data.open_db(filename)
+    try:
+        result = [ row[0] for row in db.cursor().execute(check) ]
+    except apsw.Error as e:
+        result = [ str(e) ]
+    finally:
+        db.close()
+    return result == [ 'ok' ]
+
+
+#
+# Saves copies of an in-memory database to disk in the background.  Pages are copied a few at a time so that the
+# threads using the database only ever wait for one small step.  The copy goes to a temporary file which is renamed
+# into place along with its checksum, and nothing is written if the database hasn't changed since the last snapshot.
+#
+class ObSnapshotThread (obplayer.ObThread):
+    def __init__(self, data, filename):
+        obplayer.ObThread.__init__(self)
+        self.daemon = True
+        self.data = data
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.requested = threading.Event()
+
+        # the connection and its change count as of the last snapshot (or restore)
+        self.last_db = data.db
+        self.last_changes = data.db.totalchanges()
+
+        self.snapshot_count = 0
+        self.skipped_count = 0
+        self.last_time = None
+        self.last_duration = None
+
+    def request(self):
+        self.requested.set()
+
+    def try_run(self):
+        while not self.stopflag.is_set():
+            self.requested.wait(SNAPSHOT_INTERVAL)
+            self.requested.clear()
+            if self.stopflag.is_set():
+                break
+            self.snapshot()
+
+    def stop(self):
+        obplayer.ObThread.stop(self)
+        self.requested.set()
+
+    #
+    # Write a snapshot if anything has changed.  With step_pages = -1 the whole database is copied in one step,
+    # which is what we want when shutting down.  Returns True if a snapshot was written.
+    #
+    def snapshot(self, step_pages=SNAPSHOT_STEP_PAGES, step_delay=SNAPSHOT_STEP_DELAY):
+        with self.lock:
+            db = self.data.db
+            changes = db.totalchanges()
+            if db is self.last_db and changes == self.last_changes:
+                self.skipped_count += 1
+                return False
+
+            start_time = time.time()
+            tmp_filename = self.filename + '.tmp'
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
+            dest = self.data.open_db(tmp_filename)
+            try:
+                with dest.backup('main', db, 'main') as backup:
+                    while True:
+                        try:
+                            if backup.step(step_pages):
+                                break
+                        except (apsw.BusyError, apsw.LockedError):
+                            # the database is in the middle of a write; try again shortly
+                            time.sleep(0.1)
+                            continue
+                        if step_delay:
+                            time.sleep(step_delay)
+            finally:
+                dest.close()
+
+            with open(self.filename + '.md5.tmp', 'w') as f:
+                f.write(file_md5(tmp_filename))
+            os.rename(tmp_filename, self.filename)
+            os.rename(self.filename + '.md5.tmp', self.filename + '.md5')
+
+            # anything written during the copy is in the snapshot too, but we can't tell, so the next one will be taken
+            self.last_db = db
+            self.last_changes = changes
+
+            self.snapshot_count += 1
+            self.last_time = time.time()
+            self.last_duration = self.last_time - start_time
+            obplayer.Log.log('saved database snapshot in ' + str(int(self.last_duration * 1000)) + 'ms', 'data')
+            return True
+
+    def get_status(self):
+        data = { }
+        data['snapshots'] = self.snapshot_count
+        data['skipped'] = self.skipped_count
+        data['last_time'] = self.last_time
+        data['last_duration'] = self.last_duration
+        return data
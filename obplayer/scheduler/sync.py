@@ -24,13 +24,25 @@ import obplayer
 
 import pycurl
 
+from .curlpool import ObCurlPool
+from .planner import ObDownloadPlanner
+from .bandwidth import ObBandwidthManager
+from .mediacache import ObMediaIndex, ObMediaWatcher
+from .filecopy import copy_media_file
+from .blobstore import ObBlobStore
+from .scrubber import ObMediaScrubber
+from .progressive import ObProgressiveServer
+
 import xml.dom.minidom
+import xml.etree.ElementTree as ElementTree
+from xml.sax.saxutils import XMLGenerator
 
+import io
 import os
 import re
+import gzip
 import time
 import hashlib
-import shutil
 import sys
 import json
 import calendar
@@ -44,11 +56,13 @@ MIN_SERVER_VERSION = '4.1.1-20150507'
 
 if sys.version.startswith('3'):
     import urllib.parse as urllib
+    import queue
     unicode = str
     def strascii(text):
         return text
 else:
     import urllib
+    import Queue as queue
     def strascii(text):
         return unicode(text).encode('ascii', 'xmlcharrefreplace')
 
@@ -122,6 +136,232 @@ def xml_get_first_tag_value(element, tag, default=None):
 
 
 
+# ElementTree equivalents of the above, used by the streaming schedule parser.
+def etree_get_text(element, tag, default=''):
+    child = element.find(tag)
+    if child is None:
+        return default
+    return child.text or ''
+
+
+def etree_get_media_item(node):
+    media_item = {}
+
+    media_item['id'] = etree_get_text(node, 'id', 0)
+    media_item['filename'] = etree_get_text(node, 'filename')
+    media_item['title'] = etree_get_text(node, 'title')
+    media_item['artist'] = etree_get_text(node, 'artist')
+    media_item['order'] = etree_get_text(node, 'order')
+    media_item['offset'] = etree_get_text(node, 'offset')
+    media_item['duration'] = etree_get_text(node, 'duration')
+    media_item['type'] = etree_get_text(node, 'type')
+    media_item['file_hash'] = etree_get_text(node, 'hash')
+    media_item['file_size'] = etree_get_text(node, 'filesize')
+    media_item['file_location'] = etree_get_text(node, 'location')
+    media_item['approved'] = etree_get_text(node, 'approved')
+    media_item['archived'] = etree_get_text(node, 'archived')
+
+    return media_item
+
+
+# the element name used for each entry of a JSON list, by the name of the list
+JSON_LIST_ITEMS = { 'media': 'item', 'liveassist_buttons': 'group' }
+
+#
+# Convert a show from a JSON schedule into the ElementTree elements that the equivalent xml would produce.
+#
+def json_to_element(tag, value):
+    element = ElementTree.Element(tag)
+    if isinstance(value, dict):
+        for (name, child) in value.items():
+            element.append(json_to_element(name, child))
+    elif isinstance(value, list):
+        for child in value:
+            element.append(json_to_element(JSON_LIST_ITEMS.get(tag, 'item'), child))
+    elif isinstance(value, bool):
+        element.text = '1' if value else '0'
+    elif value is not None:
+        element.text = str(value)
+    return element
+
+
+#
+# Collects a response from curl.  The body is kept as a list of byte strings (available as data, or decoded as
+# buffer), unless a write_function is given to stream it to.
+#
+class CurlResponse (object):
+    def __init__(self, write_function=None):
+        self.chunks = []
+        self.size = 0
+        self.write_function = write_function
+        self.code = None
+        self.headers = {}
+        self.timed_out = False
+
+    def __call__(self, data):
+        self.size += len(data)
+        if self.write_function:
+            return self.write_function(data)
+        self.chunks.append(data)
+
+    @property
+    def data(self):
+        return b''.join(self.chunks)
+
+    @property
+    def buffer(self):
+        return self.data.decode('utf-8')
+
+    def header(self, line):
+        line = line.decode('iso-8859-1').strip()
+        if line.startswith('HTTP/'):
+            # a new status line (after a redirect or 100 Continue) starts a new set of headers
+            self.code = int(line.split()[1])
+            self.headers = {}
+        elif ':' in line:
+            (name, _, value) = line.partition(':')
+            self.headers[name.strip().lower()] = value.strip()
+
+
+class ObSyncCancelled (Exception):
+    pass
+
+
+class ObSyncServerError (Exception):
+    pass
+
+
+#
+# Incremental schedule parser.  Data is fed in as it arrives from the server, and each show is written to
+# RemoteData as soon as its closing tag is seen, after which it is thrown away.  This keeps memory use bounded by
+# the size of a single show rather than the whole schedule.
+#
+# Servers that support it may send the schedule as JSON instead, which is smaller and faster to parse.  It has the
+# same structure as the xml ({ "shows": [ { "id": ..., "media": [ { ... } ], "liveassist_buttons": [ { "name": ...,
+# "media": [ ... ] } ] } ] }, plus "error" or "not_modified"), and is detected by its first character.  A JSON
+# schedule is parsed all at once, and each show is converted to the same elements add_show() gets from the xml.
+#
+class ObScheduleParser (object):
+    def __init__(self, cutoff_time, ignore_showlock=False):
+        self.cutoff_time = cutoff_time
+        self.ignore_showlock = ignore_showlock
+
+        self.parser = ElementTree.XMLPullParser(events=('start', 'end'))
+        self.elements = []
+        self.exception = None
+        self.error = None
+        self.not_modified = False
+        self.start_times_list = []
+        self.md5 = hashlib.md5()
+
+        # set to a list of the chunks received, if the schedule turns out to be JSON
+        self.json_chunks = None
+
+    # called as the curl write function. any exception aborts the transfer, and is raised again by close().
+    def feed(self, data):
+        try:
+            self.md5.update(data)
+            if self.json_chunks is None and data.lstrip()[:1] == b'{' and not self.elements:
+                self.json_chunks = []
+            if self.json_chunks is not None:
+                self.json_chunks.append(data)
+                return
+            self.parser.feed(data)
+            self.process_events()
+        except Exception as e:
+            self.exception = e
+            return 0
+
+    def close(self):
+        if self.exception is not None:
+            raise self.exception
+        if self.json_chunks is not None:
+            self.process_json(b''.join(self.json_chunks).decode('utf-8'))
+        else:
+            self.parser.close()
+            self.process_events()
+        if self.error is not None:
+            raise ObSyncServerError(self.error)
+
+    def process_json(self, text):
+        try:
+            schedule = json.loads(text)
+        except ValueError as e:
+            raise ElementTree.ParseError('invalid JSON schedule: ' + str(e))
+
+        if 'error' in schedule:
+            self.error = str(schedule['error'])
+            return
+        if schedule.get('not_modified'):
+            self.not_modified = True
+
+        for show in schedule.get('shows', []):
+            self.add_show(json_to_element('show', show))
+
+    def hexdigest(self):
+        return self.md5.hexdigest()
+
+    def process_events(self):
+        for (event, element) in self.parser.read_events():
+            if event == 'start':
+                self.elements.append(element)
+                continue
+
+            self.elements.pop()
+            if element.tag == 'error':
+                self.error = element.text or ''
+            elif element.tag == 'not_modified':
+                self.not_modified = True
+            elif element.tag == 'show' and self.error is None:
+                self.add_show(element)
+                if self.elements:
+                    self.elements[-1].remove(element)
+
+    def add_show(self, show):
+        show_id = etree_get_text(show, 'id', None)
+        show_type = etree_get_text(show, 'type', None)
+        show_date = etree_get_text(show, 'date', None)
+        show_time = etree_get_text(show, 'time', None)
+        show_name = etree_get_text(show, 'name', '')
+        show_description = etree_get_text(show, 'description', '')
+        show_duration = etree_get_text(show, 'duration', 0)
+        show_last_updated = etree_get_text(show, 'last_updated', 0)
+        show_media = show.find('media')
+        show_liveassist = show.find('liveassist_buttons')
+
+        show_start_datetime = time.strptime(show_date + ' ' + show_time, '%Y-%m-%d %H:%M:%S')
+        show_start_timestamp = calendar.timegm(show_start_datetime)
+
+        # only consider shows that are beyond the showlock time (unless ignore_showlock)
+        if not self.ignore_showlock and show_start_timestamp - self.cutoff_time <= 0:
+            return
+
+        local_show_id = obplayer.RemoteData.show_addedit(show_id, show_name, show_type, show_description, show_start_timestamp, show_duration, show_last_updated)
+
+        self.start_times_list.append(show_start_timestamp)
+
+        if local_show_id is False:
+            return
+
+        for media in show_media.findall('item'):
+            obplayer.RemoteData.show_media_add(local_show_id, show_id, etree_get_media_item(media))
+
+        if show_liveassist is not None:
+
+            obplayer.RemoteData.group_remove_old(local_show_id)
+            for group in show_liveassist.findall('group'):
+                group_name = etree_get_text(group, 'name')
+                group_id = obplayer.RemoteData.group_add(local_show_id, group_name)
+
+                for media in group.find('media').findall('item'):
+                    obplayer.RemoteData.group_item_add(group_id, etree_get_media_item(media))
+
+            group_id = obplayer.RemoteData.group_add(local_show_id, 'System Requests')
+            obplayer.RemoteData.group_item_add(group_id, { 'id': -1, 'order': 0, 'artist': 'System', 'title': "Station Line-In Audio Source", 'type': 'linein', 'duration': 3600, 'filename': '', 'file_hash': '', 'file_size': 0, 'file_location': '', 'approved': 0, 'archived': 0 })
+            obplayer.RemoteData.group_item_add(group_id, { 'id': -1, 'order': 1, 'artist': 'System', 'title': "Remote RTP Audio Source", 'type': 'rtp', 'duration': 3600, 'filename': '', 'file_hash': '', 'file_size': 0, 'file_location': '', 'approved': 0, 'archived': 0 })
+            #obplayer.RemoteData.group_item_add(group_id, { 'id': -1, 'order': 1, 'artist': 'System', 'title': "Local Streamer Audio Source", 'type': 'sdp', 'duration': 3600, 'filename': 'local_streamer.sdp', 'file_hash': '', 'file_size': 0, 'file_location': os.getcwd() + '/tools', 'approved': 0, 'archived': 0 })
+
+
 class VersionUpdateThread (obplayer.ObThread):
     def try_run(self):
         if obplayer.Config.version:
@@ -139,13 +379,17 @@ class SyncShowsThread (obplayer.ObThread):
                 obplayer.Log.log("exception in " + self.name + " thread", 'error')
                 obplayer.Log.log(traceback.format_exc(), 'error')
 
-            if self.stopflag.wait(self.synctime):
+            # wait for the next poll, or until we're told the schedule has changed
+            obplayer.Sync.shows_changed.wait(obplayer.Sync.poll_interval(self.synctime))
+            obplayer.Sync.shows_changed.clear()
+            if self.stopflag.is_set():
                 break
 
     # TODO this is temporary until you can have Sync check the stop flags directly
     def stop(self):
         obplayer.ObThread.stop(self)
         obplayer.Sync.quit = True
+        obplayer.Sync.shows_changed.set()
 
 
 class SyncPlaylogThread (obplayer.ObThread):
@@ -170,7 +414,13 @@ class SyncPlaylogThread (obplayer.ObThread):
 class SyncEmergThread (obplayer.ObThread):
     def run(self):
         self.synctime = int(60 * obplayer.Config.setting('sync_freq_priority'))
-        while not self.stopflag.wait(self.synctime):
+        while True:
+            # wait for the next poll, or until we're told the priority broadcasts have changed
+            obplayer.Sync.priority_changed.wait(obplayer.Sync.poll_interval(self.synctime))
+            obplayer.Sync.priority_changed.clear()
+            if self.stopflag.is_set():
+                break
+
             try:
                 obplayer.Sync.sync_priority_broadcasts()
             except:
@@ -180,6 +430,7 @@ class SyncEmergThread (obplayer.ObThread):
     def stop(self):
         obplayer.ObThread.stop(self)
         obplayer.Sync.quit = True
+        obplayer.Sync.priority_changed.set()
 
 
 class SyncMediaThread (obplayer.ObThread):
@@ -197,6 +448,88 @@ class SyncMediaThread (obplayer.ObThread):
         obplayer.Sync.quit = True
 
 
+#
+# Holds a long-poll request open to the server, which answers as soon as the schedule or priority broadcasts
+# change (or when its timeout runs out).  Changes wake up SyncShowsThread or SyncEmergThread right away.  While
+# we're connected they poll much less often; if the server doesn't support it, or the connection drops, we retry
+# with an increasing delay and they go back to their usual polling intervals.
+#
+class SyncNotifyThread (obplayer.ObThread):
+    def try_run(self):
+        if not obplayer.Config.setting('sync_notify_enable'):
+            self.remove_thread()
+            return
+
+        retry_delay = 0
+        while not self.stopflag.is_set():
+            if obplayer.Sync.wait_for_changes():
+                retry_delay = 0
+                continue
+
+            retry_delay = min(max(retry_delay * 2, 5), 300)
+            if self.stopflag.wait(retry_delay):
+                break
+
+    def stop(self):
+        obplayer.ObThread.stop(self)
+        obplayer.Sync.quit = True
+
+
+#
+# Sends now playing updates to the server.  Updates are put in a single slot and the latest one always wins, so a
+# burst of track changes results in one request, and a slow server can never leave an older update showing.
+# Failed updates are retried with an increasing delay, unless a newer update replaces them first.
+#
+class NowPlayingUpdateThread (obplayer.ObThread):
+    def __init__(self):
+        obplayer.ObThread.__init__(self)
+        self.daemon = True
+        self.condition = threading.Condition()
+        self.pending = None
+
+    def update(self, update):
+        with self.condition:
+            self.pending = update
+            self.condition.notify()
+
+    def try_run(self):
+        retry_delay = 0
+        while not self.stopflag.is_set():
+            with self.condition:
+                while self.pending is None and not self.stopflag.is_set():
+                    self.condition.wait()
+                update = self.pending
+                self.pending = None
+
+            if update is None:
+                break
+
+            # this thread is the only one sending updates, so it mustn't die on an error; it's retried like a failure
+            try:
+                sent = obplayer.Sync.now_playing_request(*update)
+            except:
+                obplayer.Log.log("exception in " + self.name + " thread", 'error')
+                obplayer.Log.log(traceback.format_exc(), 'error')
+                sent = False
+
+            if sent:
+                retry_delay = 0
+                continue
+
+            retry_delay = min(max(retry_delay * 2, 5), 300)
+            obplayer.Log.log('now playing update failed, retrying in ' + str(retry_delay) + ' seconds', 'sync')
+
+            with self.condition:
+                if self.pending is None:
+                    self.pending = update
+                    self.condition.wait(retry_delay)
+
+    def stop(self):
+        obplayer.ObThread.stop(self)
+        with self.condition:
+            self.condition.notify()
+
+
 class Sync_Alert_Media_Thread(obplayer.ObThread):
     # def __init__(self):
     #     # Download first nations alert data from server.
@@ -233,12 +566,201 @@ class Sync_Alert_Media_Thread(obplayer.ObThread):
         obplayer.ObThread.stop(self)
 
 
+# how long (in seconds) to wait for the server to answer a long-poll request for changes
+NOTIFY_TIMEOUT = 120
+
+# the server is asked to answer this many seconds before we give up, so that it's the one to end a quiet long-poll
+NOTIFY_TIMEOUT_MARGIN = 15
+
+# while the server is pushing changes, poll this many times less often
+NOTIFY_POLL_FACTOR = 6
+
+# how often (in seconds) to update the download plan's estimates while media is downloading
+PLAN_UPDATE_INTERVAL = 10
+
+# seconds of media that must already be downloaded ahead of the play position before playing a file still in transit
+PROGRESSIVE_BUFFER_TIME = 10
+
+# the download must be expected to finish this much sooner than needed (ie. 1.5 means in two thirds of the time)
+PROGRESSIVE_RATE_MARGIN = 1.5
+
+#
+# Keeps track of a single media download so that per-file progress can be reported while downloads run concurrently.
+#
+class MediaDownloadProgress (object):
+    def __init__(self, media):
+        self.media = media
+        self.status = 'queued'
+        self.offset = 0
+        self.downloaded = 0
+        self.total = media['file_size']
+        self.start_time = None
+        self.end_time = None
+
+        # the file being written while downloading over http, for progressive playback
+        self.part_filename = None
+
+    def start(self):
+        self.status = 'downloading'
+        self.start_time = time.time()
+
+    def finish(self, status):
+        self.status = status
+        self.end_time = time.time()
+
+    def rate(self):
+        if not self.start_time:
+            return 0
+        elapsed = (self.end_time or time.time()) - self.start_time
+        if elapsed <= 0:
+            return 0
+        return (self.downloaded - self.offset) / elapsed
+
+    def curl_progress(self, download_t, download_d, upload_t, upload_d):
+        self.downloaded = self.offset + download_d
+        if download_t:
+            self.total = self.offset + download_t
+        return obplayer.Sync.curl_progress(download_t, download_d, upload_t, upload_d)
+
+    #
+    # Return True if playing this media from the given offset (in seconds) while it downloads should never catch up
+    # to the download, at the rate measured so far (with some margin).  Playback is assumed to read the file evenly.
+    #
+    def can_play(self, duration, offset=0):
+        file_size = self.media['file_size']
+        rate = self.rate()
+        if self.status != 'downloading' or duration <= 0 or file_size <= 0 or rate <= 0:
+            return False
+
+        play_rate = file_size / float(duration)
+        if self.downloaded < min(file_size, (offset + PROGRESSIVE_BUFFER_TIME) * play_rate):
+            return False
+
+        remaining_time = (file_size - self.downloaded) / rate * PROGRESSIVE_RATE_MARGIN
+        return remaining_time <= duration - offset
+
+    def status_info(self):
+        return {
+            'media_id' : self.media['media_id'],
+            'filename' : self.media['filename'],
+            'status' : self.status,
+            'downloaded' : self.downloaded,
+            'total' : self.total,
+            'rate' : self.rate()
+        }
+
+
+#
+# Writes a media download into a .part file.  If some of the file is already on disk, we ask the server for the rest
+# with a Range header, and only append if it actually replies with partial content; otherwise we start over.
+#
+class MediaPartFile (object):
+    def __init__(self, filename, throttle=None, progress=None):
+        self.filename = filename
+        self.throttle = throttle
+        self.progress = progress
+        self.resume_from = os.path.getsize(filename) if os.path.exists(filename) else 0
+        self.response_code = None
+        self.fp = None
+
+    def header(self, line):
+        line = line.decode('iso-8859-1')
+        if line.startswith('HTTP/'):
+            self.response_code = int(line.split()[1])
+            # the server is sending the whole file rather than the rest of it, so we're starting over
+            if self.resume_from > 0 and 200 <= self.response_code < 400 and self.response_code != 206:
+                self.restart()
+
+    def restart(self):
+        self.resume_from = 0
+        if self.progress:
+            self.progress.offset = 0
+            self.progress.downloaded = 0
+
+    def write(self, data):
+        # don't let an error page overwrite what we have so far
+        if self.response_code and self.response_code >= 400:
+            return
+        if self.fp is None:
+            if self.resume_from > 0 and self.response_code == 206:
+                self.fp = open(self.filename, 'ab')
+            else:
+                if self.resume_from > 0:
+                    self.restart()
+                self.fp = open(self.filename, 'wb')
+        self.fp.write(data)
+        if self.throttle:
+            self.throttle(len(data))
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+    def discard(self):
+        self.close()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+        self.resume_from = 0
+
+
 class ObSync:
 
     def __init__(self):
         self.quit = False
         self.priority_sync_running = False
 
+        # hash and etag of the last schedule we applied, sent with each sync so the server can reply 'not modified'
+        self.schedule_hash = None
+        self.schedule_etag = None
+
+        # set when the server tells us something has changed (see SyncNotifyThread)
+        self.shows_changed = threading.Event()
+        self.priority_changed = threading.Event()
+        self.notify_connected = False
+        self.notify_token = None
+
+        # reusable curl handles for all requests to the sync server
+        self.curl_pool = ObCurlPool(obplayer.Config.setting('sync_media_workers') + 3)
+
+        # sends now playing updates, started along with the other sync threads
+        self.now_playing_thread = NowPlayingUpdateThread()
+
+        # orders media downloads by when they are needed on air
+        self.planner = ObDownloadPlanner()
+
+        # rate limits media downloads
+        self.bandwidth = ObBandwidthManager()
+
+        # index of the files in the remote media directory, used to find unused media
+        self.media_index = ObMediaIndex(obplayer.Config.setting('remote_media'))
+        self.media_watcher = ObMediaWatcher(self.media_index)
+
+        # content addressed store used to share identical media files (see sync_media_dedup)
+        self.blob_store = ObBlobStore(obplayer.Config.setting('remote_media'))
+
+        # checks media against its hash in the background, started along with the other sync threads
+        self.scrubber = ObMediaScrubber()
+
+        # ids of media which failed a hash check and must be downloaded again
+        self.redownload = set()
+
+        # serves media that is still downloading to the player, if enabled
+        self.progressive_server = None
+        if obplayer.Config.setting('sync_media_progressive'):
+            self.progressive_server = ObProgressiveServer()
+
+        # media downloads in progress, keyed by media_id
+        self.downloads = {}
+        self.downloads_lock = threading.Lock()
+
+        # bytes received from sync requests, before and after decompression
+        self.transfer_bytes = 0
+        self.transfer_decoded_bytes = 0
+
+        # number of local/backup media copies made with each method (hardlink, reflink, etc)
+        self.copy_methods = {}
+
     def curl_progress(self, download_t, download_d, upload_t, upload_d):
         if self.quit:
             return True
@@ -255,12 +777,10 @@ class ObSync:
         postfields['longitude'] = obplayer.Config.setting('location_longitude')
         postfields['latitude'] = obplayer.Config.setting('location_latitude')
 
-        curl = pycurl.Curl()
+        curl = self.curl_pool.acquire()
 
         enc_postfields = urllib.urlencode(postfields)
 
-        curl.setopt(pycurl.NOSIGNAL, 1)
-        curl.setopt(pycurl.USERAGENT, 'OpenBroadcaster Player')
         curl.setopt(pycurl.URL, obplayer.Config.setting('sync_url') + '?action=version')
         curl.setopt(pycurl.HEADER, False)
         curl.setopt(pycurl.POST, True)
@@ -272,12 +792,6 @@ class ObSync:
         curl.setopt(pycurl.NOPROGRESS, 0)
         curl.setopt(pycurl.PROGRESSFUNCTION, self.curl_progress)
 
-        class CurlResponse:
-            def __init__(self):
-                self.buffer = u''
-            def __call__(self, data):
-                self.buffer += data.decode('utf-8')
-
         curl_response = CurlResponse()
         curl.setopt(pycurl.WRITEFUNCTION, curl_response)
 
@@ -287,7 +801,7 @@ class ObSync:
             obplayer.Log.log("exception in VersionUpdate thread", 'error')
             obplayer.Log.log(traceback.format_exc(), 'error')
 
-        curl.close()
+        self.curl_pool.release(curl)
 
         if curl_response.buffer:
             version = json.loads(curl_response.buffer)
@@ -316,96 +830,73 @@ class ObSync:
 
         cutoff_time = time.time() + obplayer.Config.setting('sync_showlock') * 60
 
-        syncfiles = {}
-
         obplayer.Log.log('fetching show data from server', 'sync')
 
-        schedule_xml = self.sync_request('schedule')
+        # the schedule is parsed and written to a shadow copy of the database as it arrives, which is swapped in
+        # when it's complete. a failed or cancelled sync leaves the previous schedule untouched.
+        schedule = ObScheduleParser(cutoff_time, ignore_showlock)
+        response = CurlResponse(schedule.feed)
 
-        # TODO for debugging purposes, write schedule to file
-        #with open(obplayer.ObData.get_datadir() + "/schedules/" + time.strftime('%Y.%m.%d %H:%M:%S') + ".xml", 'w') as f:
-        #    f.write(schedule_xml)
-        #print(schedule_xml)
+        # send what we know about the schedule we already have, unless we're doing a database reset
+        fields = { }
+        headers = [ 'Accept: application/json, text/xml;q=0.9' ]
+        if not ignore_showlock:
+            if self.schedule_hash:
+                fields['schedule_hash'] = self.schedule_hash
+            if self.schedule_etag:
+                headers.append('If-None-Match: ' + self.schedule_etag)
 
+        # shows that are over are removed on every sync, whether or not the schedule has changed (or the server can
+        # be reached). nothing is written unless a show has ended.
+        with obplayer.RemoteData.shadow([ 'shows', 'shows_media', 'groups', 'group_items' ]):
+            obplayer.RemoteData.show_remove_old()
 
-        # trying to quit?
-        if self.quit:
-            return
+        generation = obplayer.RemoteData.generation
 
         try:
-            schedule = xml.dom.minidom.parseString(schedule_xml)
-        except:
-            obplayer.Log.log('unable to sync - possible configuration, server, or network error.', 'error')
-            return
-
-        error = schedule.getElementsByTagName('error')
-        if len(error) > 0:
-            error_msg = xml_get_text(error[0])
-            obplayer.Log.log('Unable to sync with server.  (' + error_msg + ')', 'error')
-            return
-
-        obplayer.Log.log('writing data to database', 'sync')
-
-        start_times_list = []
-
-        for show in schedule.getElementsByTagName('show'):
-
-            show_id = xml_get_first_tag_value(show, 'id')
-            show_type = xml_get_first_tag_value(show, 'type')
-            show_date = xml_get_first_tag_value(show, 'date')
-            show_time = xml_get_first_tag_value(show, 'time')
-            show_name = xml_get_first_tag_value(show, 'name', '')
-            show_description = xml_get_first_tag_value(show, 'description', '')
-            show_duration = xml_get_first_tag_value(show, 'duration', 0)
-            show_last_updated = xml_get_first_tag_value(show, 'last_updated', 0)
-            show_media = xml_get_direct_children(show, 'media')[0]
-
-            show_liveassist = xml_get_direct_children(show, 'liveassist_buttons')
-            if show_liveassist:
-                show_liveassist = show_liveassist[0]
-
-            show_start_datetime = time.strptime(show_date + ' ' + show_time, '%Y-%m-%d %H:%M:%S')
-            # show_start_timestamp=time.mktime(show_start_datetime) - time.timezone;
-            show_start_timestamp = calendar.timegm(show_start_datetime)
+            with obplayer.RemoteData.shadow([ 'shows', 'shows_media', 'groups', 'group_items' ]):
+                self.sync_request('schedule', response=response, headers=headers, fields=fields)
 
-            # only consider shows that are beyond the showlock time (unless ignore_showlock)
-            if ignore_showlock or show_start_timestamp - cutoff_time > 0:
+                # trying to quit?
+                if self.quit:
+                    raise ObSyncCancelled()
 
-                local_show_id = obplayer.RemoteData.show_addedit(show_id, show_name, show_type, show_description, show_start_timestamp, show_duration, show_last_updated)
+                not_modified = response.code == 304
+                if not not_modified:
+                    schedule.close()
+                    not_modified = schedule.not_modified
 
-                start_times_list.append(show_start_timestamp)
+                if not not_modified:
+                    obplayer.RemoteData.show_remove_deleted(schedule.start_times_list, cutoff_time)
 
-                if local_show_id is not False:
-
-                    for media in xml_get_direct_children(show_media, 'item'):
-                        media_item = xml_get_media_item(media)
-                        obplayer.RemoteData.show_media_add(local_show_id, show_id, media_item)
+        except ObSyncCancelled:
+            return
+        except ObSyncServerError as e:
+            obplayer.Log.log('Unable to sync with server.  (' + str(e) + ')', 'error')
+            return
+        except ElementTree.ParseError:
+            obplayer.Log.log('unable to sync - possible configuration, server, or network error.', 'error')
+            return
 
-                    if show_liveassist:
+        # retry any media that failed to download last time, even if the schedule hasn't changed
+        self.sync_media_required = True
 
-                        obplayer.RemoteData.group_remove_old(local_show_id)
-                        for group in xml_get_direct_children(show_liveassist, 'group'):
-                            group_name = xml_get_text(xml_get_direct_children(group, 'name')[0])
-                            media_list = xml_get_direct_children(group, 'media')[0]
-                            group_id = obplayer.RemoteData.group_add(local_show_id, group_name)
+        if not_modified:
+            obplayer.Log.log('schedule not modified', 'sync')
+            return
 
-                            for media in xml_get_direct_children(media_list, 'item'):
-                                media_item = xml_get_media_item(media)
-                                obplayer.RemoteData.group_item_add(group_id, media_item)
+        self.schedule_hash = schedule.hexdigest()
+        self.schedule_etag = response.headers.get('etag', None)
 
-                        group_id = obplayer.RemoteData.group_add(local_show_id, 'System Requests')
-                        obplayer.RemoteData.group_item_add(group_id, { 'id': -1, 'order': 0, 'artist': 'System', 'title': "Station Line-In Audio Source", 'type': 'linein', 'duration': 3600, 'filename': '', 'file_hash': '', 'file_size': 0, 'file_location': '', 'approved': 0, 'archived': 0 })
-                        obplayer.RemoteData.group_item_add(group_id, { 'id': -1, 'order': 1, 'artist': 'System', 'title': "Remote RTP Audio Source", 'type': 'rtp', 'duration': 3600, 'filename': '', 'file_hash': '', 'file_size': 0, 'file_location': '', 'approved': 0, 'archived': 0 })
-                        #obplayer.RemoteData.group_item_add(group_id, { 'id': -1, 'order': 1, 'artist': 'System', 'title': "Local Streamer Audio Source", 'type': 'sdp', 'duration': 3600, 'filename': 'local_streamer.sdp', 'file_hash': '', 'file_size': 0, 'file_location': os.getcwd() + '/tools', 'approved': 0, 'archived': 0 })
+        if obplayer.RemoteData.generation == generation:
+            obplayer.Log.log('schedule unchanged', 'sync')
+            return
 
-        obplayer.RemoteData.show_remove_deleted(start_times_list, cutoff_time)
-        obplayer.RemoteData.show_remove_old()
+        obplayer.Log.log('done writing schedule to database', 'sync')
 
         obplayer.Scheduler.update_show_update_time()
 
-        self.sync_media_required = True
-
-        # backup database to disk.
+        # save the new schedule to disk in the background.
         obplayer.RemoteData.backup()
 
     #
@@ -443,45 +934,46 @@ class ObSync:
         # setup our broadcaster id list, used to remove deleted items from db after adding below.
         broadcast_id_list = []
 
-        for broadcast in broadcasts.getElementsByTagName('broadcast'):
-            broadcast_id = xml_get_text(broadcast.getElementsByTagName('id')[0])
-            broadcast_start = xml_get_text(broadcast.getElementsByTagName('start_timestamp')[0])
-            broadcast_end = xml_get_text(broadcast.getElementsByTagName('end_timestamp')[0])
-            broadcast_frequency = xml_get_text(broadcast.getElementsByTagName('frequency')[0])
-            broadcast_artist = xml_get_text(broadcast.getElementsByTagName('artist')[0])
-            broadcast_filename = xml_get_text(broadcast.getElementsByTagName('filename')[0])
-            broadcast_title = xml_get_text(broadcast.getElementsByTagName('title')[0])
-            broadcast_media_id = xml_get_text(broadcast.getElementsByTagName('media_id')[0])
-            broadcast_duration = xml_get_text(broadcast.getElementsByTagName('duration')[0])
-            broadcast_media_type = xml_get_text(broadcast.getElementsByTagName('media_type')[0])
-            broadcast_file_hash = xml_get_text(broadcast.getElementsByTagName('hash')[0])
-            broadcast_file_size = xml_get_text(broadcast.getElementsByTagName('filesize')[0])
-            broadcast_file_location = xml_get_text(broadcast.getElementsByTagName('location')[0])
-            broadcast_approved = xml_get_text(broadcast.getElementsByTagName('approved')[0])
-            broadcast_archived = xml_get_text(broadcast.getElementsByTagName('archived')[0])
-
-            broadcast_id_list.append(broadcast_id)
-
-            obplayer.RemoteData.priority_broadcast_addedit(
-                broadcast_id,
-                broadcast_start,
-                broadcast_end,
-                broadcast_frequency,
-                broadcast_artist,
-                broadcast_title,
-                broadcast_filename,
-                broadcast_media_id,
-                broadcast_duration,
-                broadcast_media_type,
-                broadcast_file_hash,
-                broadcast_file_size,
-                broadcast_file_location,
-                broadcast_approved,
-                broadcast_archived,
-                )
-
-        # delete now-removed broadcasts.
-        obplayer.RemoteData.priority_broadcast_remove_deleted(broadcast_id_list)
+        with obplayer.RemoteData.shadow([ 'priority_broadcasts' ]):
+            for broadcast in broadcasts.getElementsByTagName('broadcast'):
+                broadcast_id = xml_get_text(broadcast.getElementsByTagName('id')[0])
+                broadcast_start = xml_get_text(broadcast.getElementsByTagName('start_timestamp')[0])
+                broadcast_end = xml_get_text(broadcast.getElementsByTagName('end_timestamp')[0])
+                broadcast_frequency = xml_get_text(broadcast.getElementsByTagName('frequency')[0])
+                broadcast_artist = xml_get_text(broadcast.getElementsByTagName('artist')[0])
+                broadcast_filename = xml_get_text(broadcast.getElementsByTagName('filename')[0])
+                broadcast_title = xml_get_text(broadcast.getElementsByTagName('title')[0])
+                broadcast_media_id = xml_get_text(broadcast.getElementsByTagName('media_id')[0])
+                broadcast_duration = xml_get_text(broadcast.getElementsByTagName('duration')[0])
+                broadcast_media_type = xml_get_text(broadcast.getElementsByTagName('media_type')[0])
+                broadcast_file_hash = xml_get_text(broadcast.getElementsByTagName('hash')[0])
+                broadcast_file_size = xml_get_text(broadcast.getElementsByTagName('filesize')[0])
+                broadcast_file_location = xml_get_text(broadcast.getElementsByTagName('location')[0])
+                broadcast_approved = xml_get_text(broadcast.getElementsByTagName('approved')[0])
+                broadcast_archived = xml_get_text(broadcast.getElementsByTagName('archived')[0])
+
+                broadcast_id_list.append(broadcast_id)
+
+                obplayer.RemoteData.priority_broadcast_addedit(
+                    broadcast_id,
+                    broadcast_start,
+                    broadcast_end,
+                    broadcast_frequency,
+                    broadcast_artist,
+                    broadcast_title,
+                    broadcast_filename,
+                    broadcast_media_id,
+                    broadcast_duration,
+                    broadcast_media_type,
+                    broadcast_file_hash,
+                    broadcast_file_size,
+                    broadcast_file_location,
+                    broadcast_approved,
+                    broadcast_archived,
+                    )
+
+            # delete now-removed broadcasts.
+            obplayer.RemoteData.priority_broadcast_remove_deleted(broadcast_id_list)
 
         # update gui, sync media.
         # self.sync_media();
@@ -515,82 +1007,78 @@ class ObSync:
             obplayer.Log.log('unable to sync (playlog) - possible configuration or server error', 'error')
             return
 
-        entries = obplayer.PlaylogData.get_entries_since(last_timestamp)
+        # send the playlog a page at a time, removing each page from our database once the server has accepted it.
+        # that way a failure only means resending one page, and memory use doesn't depend on how far behind we are.
+        page_size = obplayer.Config.setting('sync_playlog_page_size')
+        last_id = 0
+
+        while not self.quit:
+            entries = obplayer.PlaylogData.get_entries_since(last_timestamp, last_id, page_size)
+            if not entries:
+                break
+
+            (postxml, highest_id) = self.playlog_page_xml(entries)
 
-        # get DOM implementation to create new XML document.
-        impl = xml.dom.minidom.getDOMImplementation()
+            response_xml = self.sync_request('playlog_post', postxml, compress=obplayer.Config.setting('sync_playlog_compress'))
 
-        doc = impl.createDocument(None, 'obconnect', None)
-        playlog = doc.createElement('playlog')
-        doc.firstChild.appendChild(playlog)
+            # trying to quit? sync requestes was cancelled.
+            if self.quit:
+                return
+
+            try:
+                post_status = xml.dom.minidom.parseString(response_xml)
+                post_status_text = xml_get_text(post_status.getElementsByTagName('status')[0])
+            except:
+                post_status_text = ''
+
+            if post_status_text != 'success':
+                obplayer.Log.log('unable to submit playlog at this time', 'error')
+                return
+
+            obplayer.PlaylogData.remove_entries_since(highest_id)
+            last_id = highest_id
+
+            if len(entries) < page_size:
+                break
+
+    #
+    # Write a page of playlog entries out as XML.  Returns the XML and the highest entry id in the page.
+    #
+    def playlog_page_xml(self, entries):
+        output = io.StringIO()
+        writer = XMLGenerator(output, 'utf-8')
+
+        def write_element(name, text):
+            writer.startElement(name, {})
+            writer.characters(text)
+            writer.endElement(name)
+
+        writer.startDocument()
+        writer.startElement('obconnect', {})
+        writer.startElement('playlog', {})
 
         highest_id = 0
 
         for entry in entries:
-            xmlentry = doc.createElement('entry')
-
-            media_id_element = doc.createElement('media_id')
-            media_id_text = doc.createTextNode(str(entry['media_id']))
-            media_id_element.appendChild(media_id_text)
-            xmlentry.appendChild(media_id_element)
-
-            artist_element = doc.createElement('artist')
-            #artist_text = doc.createTextNode(unicode(entry['artist']).encode('ascii', 'xmlcharrefreplace'))
-            artist_text = doc.createTextNode(strascii(entry['artist']))
-            artist_element.appendChild(artist_text)
-            xmlentry.appendChild(artist_element)
-
-            title_element = doc.createElement('title')
-            #title_text = doc.createTextNode(unicode(entry['title']).encode('ascii', 'xmlcharrefreplace'))
-            title_text = doc.createTextNode(strascii(entry['title']))
-            title_element.appendChild(title_text)
-            xmlentry.appendChild(title_element)
-
-            datetime_element = doc.createElement('datetime')
-            datetime_text = doc.createTextNode(str(entry['datetime']))
-            datetime_element.appendChild(datetime_text)
-            xmlentry.appendChild(datetime_element)
-
-            context_element = doc.createElement('context')
-            context_text = doc.createTextNode(str(entry['context']))
-            context_element.appendChild(context_text)
-            xmlentry.appendChild(context_element)
-
-            priority_id_element = doc.createElement('emerg_id')
-            priority_id_text = doc.createTextNode(str(entry['emerg_id']))
-            priority_id_element.appendChild(priority_id_text)
-            xmlentry.appendChild(priority_id_element)
-
-            notes_element = doc.createElement('notes')
-            notes_text = doc.createTextNode(str(entry['notes']))
-            notes_element.appendChild(notes_text)
-            xmlentry.appendChild(notes_element)
-
-            playlog.appendChild(xmlentry)
+            writer.startElement('entry', {})
+            write_element('media_id', str(entry['media_id']))
+            write_element('artist', strascii(entry['artist']))
+            write_element('title', strascii(entry['title']))
+            write_element('datetime', str(entry['datetime']))
+            write_element('context', str(entry['context']))
+            write_element('emerg_id', str(entry['emerg_id']))
+            write_element('notes', str(entry['notes']))
+            writer.endElement('entry')
 
             # keep track of highest ID, we will remove everything of this ID and lower if post is a success.
             if highest_id < entry['id']:
                 highest_id = entry['id']
 
-        postxml = doc.toxml()
+        writer.endElement('playlog')
+        writer.endElement('obconnect')
+        writer.endDocument()
 
-        response_xml = self.sync_request('playlog_post', postxml)
-
-        # trying to quit? sync requestes was cancelled.
-        if self.quit:
-            return
-
-        try:
-            post_status = xml.dom.minidom.parseString(response_xml)
-            post_status_text = xml_get_text(post_status.getElementsByTagName('status')[0])
-        except:
-            post_status_text = ''
-
-        if post_status_text == 'success':
-            obplayer.PlaylogData.remove_entries_since(highest_id)
-
-        else:
-            obplayer.Log.log('unable to submit playlog at this time', 'error')
+        return (output.getvalue(), highest_id)
 
     sync_media_required = False  # set to true if sync_media should do a sync.
     sync_media_id = False  # this is the id of the file presently being downloaded
@@ -608,17 +1096,127 @@ class ObSync:
 
         media_required = obplayer.RemoteData.media_required()
 
+        fetch_list = []
         for media_row in media_required:
 
             media = media_required[media_row]
 
-            if self.check_media(media) == False:
-                self.sync_media_file = media['media_id']
-                self.fetch_media(media)
-                self.sync_media_file = False
+            if self.check_media(media) == False or media['media_id'] in self.redownload:
+                fetch_list.append(media)
+
+        self.media_index.set_required(media_required, fetch_list)
+
+        self.fetch_media_list(fetch_list)
+
+        # trying to quit? the downloads were probably aborted, so don't go deleting anything.
+        if self.quit:
+            return
 
         if delete_unused_media == True:
-            self.remove_unused_media(obplayer.Config.setting('remote_media'), media_required)
+            self.blob_store.remove_unreferenced()
+            self.media_index.remove_unused()
+
+    #
+    # Download a list of media using a bounded pool of worker threads (sync_media_workers), so that one slow
+    # file doesn't hold up everything queued behind it.  Media needed on air soonest is downloaded first.
+    # Returns once all workers have finished.
+    #
+    def fetch_media_list(self, media_list):
+        if not media_list:
+            return
+
+        num_workers = max(1, min(obplayer.Config.setting('sync_media_workers'), len(media_list)))
+        media_list = self.planner.plan_downloads(media_list, num_workers)
+
+        fetch_queue = queue.Queue()
+        with self.downloads_lock:
+            for media in media_list:
+                progress = MediaDownloadProgress(media)
+                self.downloads[media['media_id']] = progress
+                fetch_queue.put(progress)
+
+        obplayer.Log.log('downloading ' + str(len(media_list)) + ' media files using ' + str(num_workers) + ' workers', 'sync')
+
+        workers = []
+        for i in range(num_workers):
+            worker = threading.Thread(target=self.fetch_media_worker, args=(fetch_queue,), name='SyncMediaWorker-' + str(i))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        # wait for the workers, updating the download plan's estimates from the downloads in progress as we go
+        for worker in workers:
+            while worker.is_alive():
+                worker.join(PLAN_UPDATE_INTERVAL)
+                with self.downloads_lock:
+                    downloads = list(self.downloads.values())
+                self.planner.update(downloads, num_workers)
+
+        # anything left in the queue was skipped because we're quitting
+        with self.downloads_lock:
+            self.downloads = {}
+
+    def fetch_media_worker(self, fetch_queue):
+        while not self.quit:
+            try:
+                progress = fetch_queue.get_nowait()
+            except queue.Empty:
+                return
+
+            progress.start()
+            fetched = False
+            try:
+                fetched = self.fetch_media(progress.media, progress)
+                progress.finish('cancelled' if self.quit else 'complete')
+            except:
+                progress.finish('failed')
+                obplayer.Log.log("exception while fetching media " + str(progress.media['filename']), 'error')
+                obplayer.Log.log(traceback.format_exc(), 'error')
+
+            self.planner.complete(progress)
+            with self.downloads_lock:
+                self.downloads.pop(progress.media['media_id'], None)
+                # media that failed a hash check stays queued for download until a new copy is actually in place
+                if fetched:
+                    self.redownload.discard(progress.media['media_id'])
+
+    def get_download(self, media_id):
+        with self.downloads_lock:
+            return self.downloads.get(media_id, None)
+
+    #
+    # Return a uri to play media which is still downloading, or None if it isn't downloading or isn't expected to
+    # finish before playback (starting at offset seconds) catches up to it.
+    #
+    def progressive_uri(self, media, offset=0):
+        if self.progressive_server is None:
+            return None
+        progress = self.get_download(media['media_id'])
+        if progress is None or progress.part_filename is None or not progress.can_play(media['duration'], offset):
+            return None
+        return self.progressive_server.uri(media['media_id'])
+
+    def get_download_status(self):
+        with self.downloads_lock:
+            return [ progress.status_info() for progress in self.downloads.values() ]
+
+    #
+    # Return sync status information for the admin interface.
+    #
+    def get_status(self):
+        data = { }
+        data['downloads'] = self.get_download_status()
+        data['download_plan'] = self.planner.get_plan()
+        data['bandwidth'] = self.bandwidth.get_status()
+        data['media_index'] = self.media_index.get_status()
+        data['copy_methods'] = dict(self.copy_methods)
+        data['blob_store'] = self.blob_store.get_status()
+        data['notify_connected'] = self.notify_connected
+        data['snapshot'] = obplayer.RemoteData.snapshot.get_status()
+        data['transfer_bytes'] = self.transfer_bytes
+        data['transfer_decoded_bytes'] = self.transfer_decoded_bytes
+        data['scrubber'] = self.scrubber.get_status()
+        return data
 
     def sync_alert_media(self):
         media_required = obplayer.RemoteData.alert_media_required()
@@ -632,6 +1230,18 @@ class ObSync:
                 self.fetch_alert_media(media)
                 self.sync_media_file = False
 
+    #
+    # Queue media which failed a hash check to be downloaded again on the next media sync.  The bad file is left in
+    # place until the new one replaces it.
+    #
+    def redownload_media(self, media):
+        media_outfilename = obplayer.Config.setting('remote_media') + '/' + media['file_location'][0] + '/' + media['file_location'][1] + '/' + media['filename']
+        self.blob_store.discard(media['file_hash'], media_outfilename)
+
+        with self.downloads_lock:
+            self.redownload.add(media['media_id'])
+        self.sync_media_required = True
+
     #
     #
     # uses media['file_location'], media['file_size'], media['filename'] to see if available media is the correct filesize.
@@ -645,7 +1255,11 @@ class ObSync:
         else:
             media_fullpath = obplayer.Config.setting('remote_media') + '/' + media['file_location'][0] + '/' + media['file_location'][1] + '/' + media['filename']
 
-        # TODO provide file hash check (slow) as an option.
+        # the media index answers without touching the disk, as long as it's being kept current
+        if not alert_mode:
+            available = self.media_index.available(media_fullpath, media['file_size'])
+            if available is not None:
+                return available
 
         if os.path.exists(media_fullpath):
             localfile_size = os.path.getsize(media_fullpath)
@@ -657,40 +1271,18 @@ class ObSync:
 
         return True
 
-    #
-    # removed unusued media from remote media directory. (called recursively)
-    #
-    def remove_unused_media(self, searchdir, media_required):
-
-        dirlist = os.listdir(searchdir)
-        for thisfile in dirlist:
-
-            if os.path.isdir(searchdir + '/' + thisfile):
-                self.remove_unused_media(searchdir + '/' + thisfile, media_required)
-            else:
-
-                try:
-                    media_required[thisfile]
-                except:
-                    obplayer.Log.log('deleting unused media: ' + searchdir + '/' + thisfile, 'sync')
-                    try:
-                        os.remove(searchdir + '/' + thisfile)
-                    except:
-                        obplayer.Log.log('unable to remove media: ' + searchdir + '/' + thisfile, 'error')
-
-    # call sync now playing update in a separate thread.
+    # queue a now playing update. only the latest update is kept, and it is sent by NowPlayingUpdateThread.
     def now_playing_update(self, playlist_id, playlist_end, media_id, media_end, show_name):
         if obplayer.Config.setting('sync_playlog_enable'):
-            t = threading.Thread(target=self.now_playing_update_thread, args=(playlist_id, playlist_end, media_id, media_end, show_name))
-            t.start()
+            self.now_playing_thread.update((playlist_id, playlist_end, media_id, media_end, show_name))
 
     #
-    # Update 'now playing' information
+    # Update 'now playing' information.  Returns True if the server accepted the update.
     #
-    def now_playing_update_thread(self, playlist_id, playlist_end, media_id, media_end, show_name):
+    def now_playing_request(self, playlist_id, playlist_end, media_id, media_end, show_name):
 
         if not obplayer.Config.setting('sync_url'):
-            return
+            return True
 
         postfields = {}
         postfields['id'] = obplayer.Config.setting('sync_device_id')
@@ -710,12 +1302,10 @@ class ObSync:
         else:
             postfields['media_end'] = ''
 
-        curl = pycurl.Curl()
+        curl = self.curl_pool.acquire()
 
         enc_postfields = urllib.urlencode(postfields)
 
-        curl.setopt(pycurl.NOSIGNAL, 1)
-        curl.setopt(pycurl.USERAGENT, 'OpenBroadcaster Player')
         curl.setopt(pycurl.URL, obplayer.Config.setting('sync_url') + '?action=now_playing')
         curl.setopt(pycurl.HEADER, False)
         curl.setopt(pycurl.POST, True)
@@ -728,26 +1318,91 @@ class ObSync:
         curl.setopt(pycurl.NOPROGRESS, 0)
         curl.setopt(pycurl.PROGRESSFUNCTION, self.curl_progress)
 
+        curl_response = CurlResponse()
+        curl.setopt(pycurl.WRITEFUNCTION, curl_response)
+
+        success = False
         try:
             curl.perform()
+            success = 200 <= curl.getinfo(pycurl.RESPONSE_CODE) < 300
         except:
             obplayer.Log.log("exception in NowPlayingUpdate thread", 'error')
             obplayer.Log.log(traceback.format_exc(), 'error')
 
-        curl.close()
+        self.curl_pool.release(curl)
+        return success
+
+    #
+    # Wait for the server to tell us about schedule or priority broadcast changes, using a long-poll request.  The
+    # server answers with <notify><token/><schedule/><priority/></notify>, with each change element only present if
+    # that data has changed since the token we sent.  Returns False if we couldn't get an answer.
+    #
+    def wait_for_changes(self):
+        response = CurlResponse()
+        fields = { 'token': self.notify_token or '', 'timeout': NOTIFY_TIMEOUT - NOTIFY_TIMEOUT_MARGIN }
+        self.sync_request('notify', response=response, fields=fields, timeout=NOTIFY_TIMEOUT)
+        if self.quit:
+            return True
+
+        # the server held on to the request for too long, but there's nothing wrong with the connection
+        if response.timed_out:
+            return True
+
+        try:
+            if response.code != 200:
+                raise ObSyncServerError('notify request failed with status ' + str(response.code))
+            notify = ElementTree.fromstring(response.data)
+            if notify.tag == 'error' or notify.find('error') is not None:
+                raise ObSyncServerError(etree_get_text(notify, 'error', notify.text))
+        except (ObSyncServerError, ElementTree.ParseError) as e:
+            self.set_notify_connected(False, str(e))
+            return False
+
+        self.notify_token = etree_get_text(notify, 'token', None)
+        self.set_notify_connected(True)
+
+        if notify.find('schedule') is not None:
+            obplayer.Log.log('server reports schedule changes', 'sync')
+            self.shows_changed.set()
+        if notify.find('priority') is not None:
+            obplayer.Log.log('server reports priority broadcast changes', 'sync')
+            self.priority_changed.set()
+        return True
+
+    def set_notify_connected(self, connected, reason=None):
+        if connected == self.notify_connected:
+            return
+        self.notify_connected = connected
+        if connected:
+            obplayer.Log.log('listening for changes from the sync server', 'sync')
+        else:
+            obplayer.Log.log('lost change notifications from the sync server, polling instead (' + str(reason) + ')', 'sync')
+            # catch up on anything we missed, and go back to the normal polling interval
+            self.shows_changed.set()
+            self.priority_changed.set()
+
+    #
+    # Return how long to wait between polls, which is longer while the server is pushing changes to us.
+    #
+    def poll_interval(self, interval):
+        if self.notify_connected:
+            return interval * NOTIFY_POLL_FACTOR
+        return interval
 
     #
     # Request sync data from web application.
     # This is used by sync (with request_type='schedule') and sync_priority_broadcasts (with request_type='emerg').
-    # Function outputs XML response from server.
+    # Function outputs XML response from server.  A CurlResponse can be passed in to stream the response elsewhere
+    # and to get at the response code and headers.  Extra request headers and post fields can also be given, and the
+    # request body can be gzip compressed (the server must accept Content-Encoding: gzip).
     #
-    def sync_request(self, request_type='', data=False):
+    def sync_request(self, request_type='', data=False, response=None, headers=None, fields=None, compress=False, timeout=None):
         sync_url = obplayer.Config.setting('sync_url')
         if not sync_url:
             obplayer.Log.log("sync url is blank, skipping sync request", 'sync')
             return ''
 
-        curl = pycurl.Curl()
+        curl = self.curl_pool.acquire()
 
         postfields = {}
         postfields['id'] = obplayer.Config.setting('sync_device_id')
@@ -755,52 +1410,74 @@ class ObSync:
         postfields['hbuffer'] = obplayer.Config.setting('sync_buffer')
         if data:
             postfields['data'] = data
+        if fields:
+            postfields.update(fields)
 
         enc_postfields = urllib.urlencode(postfields)
 
-        curl.setopt(pycurl.NOSIGNAL, 1)
-        curl.setopt(pycurl.USERAGENT, 'OpenBroadcaster Player')
+        headers = list(headers) if headers else [ ]
+        if compress:
+            enc_postfields = gzip.compress(enc_postfields.encode('utf-8'))
+            headers.append('Content-Encoding: gzip')
+
         curl.setopt(pycurl.URL, sync_url + '?action=' + request_type)
         curl.setopt(pycurl.HEADER, False)
+
+        # ask for a compressed response (any encoding curl supports). curl decompresses it as it arrives.
+        curl.setopt(pycurl.ENCODING, '')
         curl.setopt(pycurl.POST, True)
         curl.setopt(pycurl.POSTFIELDS, enc_postfields)
+        if headers:
+            curl.setopt(pycurl.HTTPHEADER, headers)
 
         # some options so that it'll abort the transfer if the speed is too low (i.e., network problem)
         # low speed abort set to 0.01Kbytes/s for 60 seconds).
         curl.setopt(pycurl.LOW_SPEED_LIMIT, 10)
         curl.setopt(pycurl.LOW_SPEED_TIME, 60)
 
+        # long-poll requests are expected to sit idle until the server has something to say
+        if timeout:
+            curl.setopt(pycurl.LOW_SPEED_TIME, timeout)
+            curl.setopt(pycurl.TIMEOUT, timeout)
+
         curl.setopt(pycurl.NOPROGRESS, 0)
         curl.setopt(pycurl.PROGRESSFUNCTION, self.curl_progress)
 
-        class CurlResponse:
-            def __init__(self):
-                self.buffer = u''
-            def __call__(self, data):
-                self.buffer += data.decode('utf-8')
-
-        curl_response = CurlResponse()
-        curl.setopt(pycurl.WRITEFUNCTION, curl_response)
+        if response is None:
+            response = CurlResponse()
+        curl.setopt(pycurl.WRITEFUNCTION, response)
+        curl.setopt(pycurl.HEADERFUNCTION, response.header)
 
         try:
             curl.perform()
         #except pycurl.error as error:
         #    (errno, errstr) = error
         #    obplayer.Log.log('network error: ' + errstr, 'error')
+        except pycurl.error as error:
+            # a long-poll running out of time just means nothing happened
+            if timeout and error.args[0] == pycurl.E_OPERATION_TIMEDOUT:
+                response.timed_out = True
+            else:
+                obplayer.Log.log("exception in sync " + request_type + " thread", 'error')
+                obplayer.Log.log(traceback.format_exc(), 'error')
         except:
             obplayer.Log.log("exception in sync " + request_type + " thread", 'error')
             obplayer.Log.log(traceback.format_exc(), 'error')
 
-        curl.close()
+        with self.downloads_lock:
+            self.transfer_bytes += int(curl.getinfo(pycurl.SIZE_DOWNLOAD))
+            self.transfer_decoded_bytes += response.size
+        self.curl_pool.release(curl)
 
-        return curl_response.buffer
+        return response.buffer
 
     #
     # Fetch media from web application.  Saves under media directory.
     # media_id : id of the media we want
     # filename : filename to save under.
+    # Returns True if a new copy of the file is now in place.
     #
-    def fetch_media(self, media):
+    def fetch_media(self, media, progress=None):
 
         media_id = media['media_id']
         filename = media['filename']
@@ -813,11 +1490,8 @@ class ObSync:
         #
         # create subdirs in media if required.
 
-        if os.path.isdir(obplayer.Config.setting('remote_media') + '/' + file_location[0]) == False:
-            os.mkdir(obplayer.Config.setting('remote_media') + '/' + file_location[0], 0o755)
-
-        if os.path.isdir(obplayer.Config.setting('remote_media') + '/' + file_location[0] + '/' + file_location[1]) == False:
-            os.mkdir(obplayer.Config.setting('remote_media') + '/' + file_location[0] + '/' + file_location[1], 0o755)
+        self.make_media_dir(obplayer.Config.setting('remote_media') + '/' + file_location[0])
+        self.make_media_dir(obplayer.Config.setting('remote_media') + '/' + file_location[0] + '/' + file_location[1])
 
         fetch_from_http = False
 
@@ -825,6 +1499,14 @@ class ObSync:
 
         media_outfilename = obplayer.Config.setting('remote_media') + '/' + file_location[0] + '/' + file_location[1] + '/' + filename
 
+        # if we already have the same file under another name, link to it instead of fetching it again.
+
+        dedup = obplayer.Config.setting('sync_media_dedup')
+        if dedup and media_id not in self.redownload and self.blob_store.link_media(media, media_outfilename):
+            obplayer.Log.log('linked ' + filename + ' from media store', 'sync')
+            self.media_index.update(media_outfilename, media_id)
+            return True
+
         # determine our sync mode - if local or backup, look in local location first.
 
         sync_mode = obplayer.Config.setting('sync_mode')
@@ -857,9 +1539,18 @@ class ObSync:
                 local_exists = False
                 file_match = False
 
+            # media that failed a hash check comes from the server in backup mode, in case the local copy is bad too
+            if sync_mode == 'backup' and media['media_id'] in self.redownload:
+                file_match = False
+
             if local_exists and (file_match or sync_mode == 'local'):  # ignoring hash mismatch if source local, there is nothing we can do anyway...
-                obplayer.Log.log('copying ' + filename + ' from local', 'sync')
-                shutil.copy(local_fullpath, media_outfilename)
+                method = self.copy_media(local_fullpath, media_outfilename + '.part')
+                obplayer.Log.log('copied ' + filename + ' from local (' + method + ')', 'sync')
+                os.rename(media_outfilename + '.part', media_outfilename)
+                self.media_index.update(media_outfilename, media_id)
+                if dedup:
+                    self.blob_store.add(media_outfilename, file_hash)
+                return True
             elif sync_mode == 'backup':
 
                 fetch_from_http = True
@@ -870,62 +1561,141 @@ class ObSync:
 
             postfields = str('media_id=' + media_id + '&id=' + str(obplayer.Config.setting('sync_device_id')) + '&pw=' + obplayer.Config.setting('sync_device_password') + '&buffer=' + str(obplayer.Config.setting('sync_buffer')))
 
-            obplayer.Log.log('downloading ' + filename, 'sync download')
+            # download into a .part file, resuming from whatever a previous attempt left behind.
+            urgent = self.bandwidth.is_urgent(self.planner.get_deadline(media['media_id']))
+            partfile = MediaPartFile(media_outfilename + '.part', lambda nbytes: self.bandwidth.throttle(nbytes, urgent), progress)
 
-            curl = pycurl.Curl()
+            if partfile.resume_from > file_size:
+                obplayer.Log.log('partial download of ' + filename + ' is larger than expected, starting over', 'sync download')
+                partfile.discard()
 
-            outfile = open(media_outfilename, 'wb')
+            if partfile.resume_from < file_size:
+                if partfile.resume_from > 0:
+                    obplayer.Log.log('resuming download of ' + filename + ' from byte ' + str(partfile.resume_from), 'sync download')
+                else:
+                    obplayer.Log.log('downloading ' + filename, 'sync download')
 
-            curl.setopt(pycurl.NOSIGNAL, 1)
-            curl.setopt(pycurl.USERAGENT, 'OpenBroadcaster Player')
-            curl.setopt(pycurl.URL, obplayer.Config.setting('sync_url') + '?action=media')
-            curl.setopt(pycurl.HEADER, False)
-            curl.setopt(pycurl.POST, True)
-            curl.setopt(pycurl.POSTFIELDS, postfields)
-            curl.setopt(pycurl.WRITEFUNCTION, outfile.write)
-            curl.setopt(pycurl.LOW_SPEED_LIMIT, 10)
-            curl.setopt(pycurl.LOW_SPEED_TIME, 60)
+                if progress:
+                    progress.offset = partfile.resume_from
+                    progress.part_filename = partfile.filename
 
-            curl.setopt(pycurl.NOPROGRESS, 0)
-            curl.setopt(pycurl.PROGRESSFUNCTION, self.curl_progress)
+                curl = self.curl_pool.acquire()
 
-            # TODO, if a perform fails, then we need to make sure sync will try again shortly (i.e. 90 seconds)
-            try:
-                curl.perform()
-                file_download_complete = True
-            except:
-                obplayer.Log.log('error fetching media, network or configuration problem.', 'error')
-                file_download_complete = False
+                curl.setopt(pycurl.URL, obplayer.Config.setting('sync_url') + '?action=media')
+                curl.setopt(pycurl.HEADER, False)
+                curl.setopt(pycurl.POST, True)
+                curl.setopt(pycurl.POSTFIELDS, postfields)
+                curl.setopt(pycurl.HEADERFUNCTION, partfile.header)
+                curl.setopt(pycurl.WRITEFUNCTION, partfile.write)
+                curl.setopt(pycurl.LOW_SPEED_LIMIT, 10)
+                curl.setopt(pycurl.LOW_SPEED_TIME, 60)
+
+                if partfile.resume_from > 0:
+                    curl.setopt(pycurl.HTTPHEADER, [ 'Range: bytes=' + str(partfile.resume_from) + '-' ])
 
-            outfile.close()
-            curl.close()
+                curl.setopt(pycurl.NOPROGRESS, 0)
+                curl.setopt(pycurl.PROGRESSFUNCTION, progress.curl_progress if progress else self.curl_progress)
 
-            # trying to quit? don't copy to backup because we probably aborted the transfer.
+                try:
+                    curl.perform()
+                except:
+                    obplayer.Log.log('error fetching media, network or configuration problem.', 'error')
+
+                partfile.close()
+                self.curl_pool.release(curl)
+                self.media_index.update(partfile.filename)
+
+            # trying to quit? leave the .part file where it is so we can resume next time.
             if self.quit:
-                return
+                return False
+
+            file_download_complete = self.finish_part_file(media_outfilename, media)
 
             # if file download complete and we're on 'backup' mode, copy the downloaded file to our backup repository to keep it up to date.
             # also check to make sure this setting is selected
 
-            if obplayer.Config.setting('sync_copy_media_to_backup') and file_download_complete and sync_mode == 'backup' and os.path.exists(media_outfilename) and os.path.getsize(media_outfilename) == file_size:
+            if obplayer.Config.setting('sync_copy_media_to_backup') and file_download_complete and sync_mode == 'backup':
                 # create our dirs in the backup location if required
-                if os.path.isdir(local_media_location + '/' + file_location[0]) == False:
-                    os.mkdir(local_media_location + '/' + file_location[0], 0o755)
+                self.make_media_dir(local_media_location + '/' + file_location[0])
+                self.make_media_dir(local_media_location + '/' + file_location[0] + '/' + file_location[1])
+
+                # copy newly downloaded file to backup
+                method = self.copy_media(media_outfilename, local_fullpath)
+                obplayer.Log.log('copied downloaded file to backup location (' + method + ')', 'sync')
 
-                if os.path.isdir(local_media_location + '/' + file_location[0] + '/' + file_location[1]) == False:
-                    os.mkdir(local_media_location + '/' + file_location[0] + '/' + file_location[1], 0o755)
+            return file_download_complete
 
-                obplayer.Log.log('copying downloaded file to backup location', 'sync')
+        return False
 
-                # copy newly downloaded file to backup
-                shutil.copy(media_outfilename, local_fullpath)
+    #
+    # Copy a media file between the local/backup location and remote media, keeping count of the copy methods used.
+    #
+    def copy_media(self, src, dst):
+        method = copy_media_file(src, dst)
+        with self.downloads_lock:
+            self.copy_methods[method] = self.copy_methods.get(method, 0) + 1
+        return method
+
+    #
+    # Check a finished .part download against the expected size (and hash, if sync_media_verify_hash is set), and
+    # move it into place with an atomic rename.  A short file is left in place to be resumed; a bad one is removed.
+    # Returns True if the media file is now in place.
+    #
+    def finish_part_file(self, media_outfilename, media):
+        part_filename = media_outfilename + '.part'
+
+        if not os.path.exists(part_filename):
+            return False
+
+        part_size = os.path.getsize(part_filename)
+        if part_size < media['file_size']:
+            obplayer.Log.log('download of ' + media['filename'] + ' incomplete (' + str(part_size) + ' of ' + str(media['file_size']) + ' bytes), will resume on next sync', 'error')
+            return False
+
+        if part_size > media['file_size']:
+            obplayer.Log.log('download of ' + media['filename'] + ' is larger than expected, discarding', 'error')
+            os.remove(part_filename)
+            self.media_index.update(part_filename)
+            return False
+
+        verified = False
+        if obplayer.Config.setting('sync_media_verify_hash') and media['file_hash']:
+            if self.file_hash(part_filename) != media['file_hash']:
+                obplayer.Log.log('download of ' + media['filename'] + ' failed hash check, discarding', 'error')
+                os.remove(part_filename)
+                self.media_index.update(part_filename)
+                return False
+            verified = True
+
+        os.rename(part_filename, media_outfilename)
+        self.media_index.update(part_filename)
+        self.media_index.update(media_outfilename, media['media_id'])
+
+        if obplayer.Config.setting('sync_media_dedup'):
+            self.blob_store.add(media_outfilename, media['file_hash'], verified)
+        return True
+
+    #
+    # Create a media subdirectory if it doesn't exist.  Several download workers may try this at the same time.
+    #
+    @staticmethod
+    def make_media_dir(path):
+        if os.path.isdir(path) == False:
+            try:
+                os.mkdir(path, 0o755)
+            except OSError:
+                if os.path.isdir(path) == False:
+                    raise
 
     #
     # Check MD5 hash of a given file.
     #
     def file_hash(self, filename):
-        fp = file(filename, 'rb')
-        return hashlib.md5(fp.read()).hexdigest()
+        md5 = hashlib.md5()
+        with open(filename, 'rb') as fp:
+            for block in iter(lambda: fp.read(1048576), b''):
+                md5.update(block)
+        return md5.hexdigest()
 
     @staticmethod
     def media_location(file_location):
@@ -947,4 +1717,5 @@ class ObSync:
         if filename and os.path.exists(file_location + '/' + filename) == False:
             obplayer.Log.log('ObPlayer: File ' + file_location + '/' + filename + ' does not exist. Skipping playback', 'error')
             return None
+        obplayer.Sync.media_index.touch(file_location + '/' + filename)
         return 'file://' + file_location + '/' + filename
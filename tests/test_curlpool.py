@@ -0,0 +1,58 @@
+import os
+import sys
+import threading
+
+import pytest
+
+pycurl = pytest.importorskip('pycurl')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'obplayer', 'scheduler'))
+from curlpool import ObCurlPool
+
+import http.server
+
+
+class Handler (http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'hello'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:' + str(httpd.server_address[1]) + '/'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def fetch(curl, url):
+    chunks = [ ]
+    curl.setopt(pycurl.URL, url)
+    curl.setopt(pycurl.WRITEFUNCTION, chunks.append)
+    curl.perform()
+    return b''.join(chunks)
+
+
+def test_reused_handle_can_make_requests(server):
+    pool = ObCurlPool()
+    curl = pool.acquire()
+    assert fetch(curl, server) == b'hello'
+    pool.release(curl)
+
+    for i in range(3):
+        reused = pool.acquire()
+        assert reused is curl
+        assert fetch(reused, server) == b'hello'
+        pool.release(reused)
+    pool.close()
@@ -0,0 +1,89 @@
+import importlib.util
+import os
+import sys
+import threading
+import types
+
+import pytest
+
+pytest.importorskip('apsw')
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'obplayer')
+
+
+class ObThread (threading.Thread):
+    def __init__(self, name=None, target=None):
+        threading.Thread.__init__(self, name=name, target=target)
+        self.stopflag = threading.Event()
+
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+#
+# ObRemoteData on its own, without importing the whole player (and everything it needs).
+#
+@pytest.fixture
+def remote_data(tmp_path, monkeypatch):
+    obplayer = types.ModuleType('obplayer')
+    obplayer.__path__ = [ PACKAGE_DIR ]
+    obplayer.Log = types.SimpleNamespace(log=lambda message, mtype=None: None)
+    obplayer.ObThread = ObThread
+    monkeypatch.setitem(sys.modules, 'obplayer', obplayer)
+
+    scheduler = types.ModuleType('obplayer.scheduler')
+    scheduler.__path__ = [ os.path.join(PACKAGE_DIR, 'scheduler') ]
+    monkeypatch.setitem(sys.modules, 'obplayer.scheduler', scheduler)
+    for name in [ 'obplayer.data', 'obplayer.scheduler.data', 'obplayer.scheduler.snapshot', 'obplayer.scheduler.showindex' ]:
+        monkeypatch.delitem(sys.modules, name, raising=False)
+
+    obplayer.ObData = load_module('obplayer.data', os.path.join(PACKAGE_DIR, 'data.py')).ObData
+    monkeypatch.setattr(obplayer.ObData, 'datadir', str(tmp_path))
+    data = load_module('obplayer.scheduler.data', os.path.join(PACKAGE_DIR, 'scheduler', 'data.py'))
+    return data.ObRemoteData()
+
+
+def media_item(media_id, filename):
+    return { 'id': media_id, 'order': 0, 'filename': filename, 'artist': '', 'title': '', 'offset': 0, 'duration': 10, 'type': 'audio', 'file_hash': '', 'file_size': 1, 'file_location': 'ab', 'approved': 1, 'archived': 0 }
+
+
+def required(data):
+    return { row[0] : row[1] for row in data.execute("SELECT media_id,refs from required_media") }
+
+
+def test_removing_liveassist_show_releases_group_media(remote_data):
+    with remote_data.shadow([ 'shows', 'shows_media', 'groups', 'group_items' ]):
+        local_show_id = remote_data.show_addedit(5, 'live', 'live_assist', '', 1000, 60, 1)
+        remote_data.show_media_add(local_show_id, 5, media_item(10, 'a.mp3'))
+        group_id = remote_data.group_add(local_show_id, 'carts')
+        remote_data.group_item_add(group_id, media_item(20, 'b.mp3'))
+        remote_data.group_item_add(group_id, media_item(21, 'c.mp3'))
+
+    assert required(remote_data) == { 10: 1, 20: 1, 21: 1 }
+    assert len(remote_data.load_groups(local_show_id)) == 1
+
+    with remote_data.shadow([ 'shows', 'shows_media', 'groups', 'group_items' ]):
+        remote_data.show_remove_old()
+
+    assert required(remote_data) == { }
+    assert remote_data.load_groups(local_show_id) == [ ]
+    assert remote_data.required_media_check()
+
+
+def test_priority_broadcast_readded_keeps_show_media_count(remote_data):
+    with remote_data.shadow([ 'shows', 'shows_media', 'groups', 'group_items' ]):
+        local_show_id = remote_data.show_addedit(5, 'show', 'standard', '', 4000000000, 60, 1)
+        remote_data.show_media_add(local_show_id, 5, media_item(10, 'a.mp3'))
+        remote_data.show_media_add(local_show_id, 5, media_item(10, 'a.mp3'))
+
+    for title in [ 'one', 'two', 'two' ]:
+        with remote_data.shadow([ 'priority_broadcasts' ]):
+            remote_data.priority_broadcast_addedit(1, 0, '', 60, '', title, 'a.mp3', 10, 10, 'audio', '', 1, 'ab', 1, 0)
+
+    assert required(remote_data) == { 10: 3 }
+    assert remote_data.required_media_check()